@@ -2,41 +2,192 @@
 Module related to file system and path operations.
 """
 
-import collections, copy, errno, grp, os, pwd, shutil, tempfile, time, uuid
+import asyncio, collections, concurrent.futures, copy, ctypes, ctypes.util, enum, errno, fcntl
+import functools, grp, hashlib, os, pwd, re, selectors, shutil, sqlite3, struct, tempfile
+import threading, time, uuid
+from stat import S_ISREG
 
 import magic
 
 from . import module
 from .datetime import datetime_now
-from .regex import from_path_patterns
+from .regex import PathMatcher
 
 _all = module.All(globals())
 
-
-def chown(path, user=None, group=None, recursive=False, **walk_kwargs):
+#: Size of the blocks compared by :func:`delta_copy`.
+DELTA_BLOCK_SIZE = 8 * 1024 * 1024
+
+#: RAM-backed file system used by the pooled :class:`TempStorage` (if writable).
+MEMORY_ROOT = '/dev/shm'
+
+#: Bytes read to detect the type of a file.
+MIME_HEADER_SIZE = 64 * 1024
+
+#: Signatures of common media types by extension (regular expressions matching the beginning of the
+#: file), detected without calling libmagic. The types are fixed and may differ from those of your
+#: version of libmagic (e.g. `audio/wav` instead of `audio/x-wav`), remove an entry to let libmagic
+#: detect its type.
+MIME_SIGNATURES = {
+    extension: (re.compile(signature, re.DOTALL), mime)
+    for extensions, signature, mime in (
+        (['.avi'], rb'RIFF.{4}AVI ', 'video/x-msvideo'),
+        (['.flac'], rb'fLaC', 'audio/flac'),
+        (['.gif'], rb'GIF8[79]a', 'image/gif'),
+        (['.jpeg', '.jpg'], rb'\xff\xd8\xff', 'image/jpeg'),
+        (['.m4a'], rb'.{4}ftypM4A ', 'audio/x-m4a'),
+        (['.mka', '.mkv'], rb'\x1a\x45\xdf\xa3.{1,32}?\x42\x82.matroska', 'video/x-matroska'),
+        (['.mov'], rb'.{4}ftypqt  ', 'video/quicktime'),
+        (['.mp3'], rb'ID3', 'audio/mpeg'),
+        (['.mp4'], rb'.{4}ftyp(?:avc1|dash|iso[2-6m]|mp4[12])', 'video/mp4'),
+        (['.mxf'], rb'\x06\x0e\x2b\x34\x02\x05\x01\x01\x0d\x01\x02', 'application/mxf'),
+        (['.png'], rb'\x89PNG\r\n\x1a\n', 'image/png'),
+        (['.wav'], rb'RIFF.{4}WAVE', 'audio/x-wav'),
+        (['.webm'], rb'\x1a\x45\xdf\xa3.{1,32}?\x42\x82.webm', 'video/webm')
+    )
+    for extension in extensions
+}
+
+
+def chown(  # pylint:disable=too-many-locals
+    path,
+    user=None,
+    group=None,
+    recursive=False,
+    max_workers=1,
+    follow_symlinks=True,
+    **walk_kwargs
+):
     """
     Change owner/group of a path, can be recursive.
     Both can be a name, an id or None to leave it unchanged.
+
+    The tree is walked with :func:`os.fwalk` and the owner of the entries is changed relatively to
+    the file descriptor of their directory, skipping those already owned by the user/group. The
+    symbolic links of the tree are followed (their target is changed) unless `follow_symlinks` is
+    False. Set `max_workers` to process the directories with a pool of threads. The `walk_kwargs`
+    are those of :func:`os.walk` (`followlinks`, `onerror` and `topdown`). Raise a
+    :class:`TypeError` for any other argument.
     """
+    topdown = walk_kwargs.pop('topdown', True)
+    followlinks, onerror = _get_walk_arguments('chown', walk_kwargs)
     uid = to_user_id(user)
     gid = to_group_id(group)
-    if recursive:
-        for dirpath, _, filenames in os.walk(path, **walk_kwargs):
-            os.chown(dirpath, uid, gid)
-            for filename in filenames:
-                os.chown(os.path.join(dirpath, filename), uid, gid)
-    else:
+    if uid == -1 and gid == -1:
+        return
+    if not recursive:
+        os.chown(path, uid, gid)
+        return
+    path = os.fspath(path)
+    if _get_owner_changes(os.stat(path), uid, gid):
         os.chown(path, uid, gid)
+    tree = os.fwalk(path, topdown=topdown, onerror=onerror, follow_symlinks=followlinks)
+    if max_workers == 1:
+        for _, dirnames, filenames, dir_fd in tree:
+            _chown_entries(dir_fd, dirnames + filenames, uid, gid, follow_symlinks)
+        return
+    # Bound the duplicated file descriptors of the directories waiting for a worker
+    semaphore = threading.BoundedSemaphore(4 * (max_workers or os.cpu_count() or 1))
+
+    def chown_entries(dir_fd, names):
+        try:
+            _chown_entries(dir_fd, names, uid, gid, follow_symlinks)
+        finally:
+            os.close(dir_fd)
+            semaphore.release()
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = []
+        for _, dirnames, filenames, dir_fd in tree:
+            semaphore.acquire()  # pylint:disable=consider-using-with
+            futures.append(executor.submit(chown_entries, os.dup(dir_fd), dirnames + filenames))
+        for future in futures:
+            future.result()
 
-def find_recursive(directory, patterns, regex=False, **walk_kwargs):
+
+def delta_copy(source_path, destination_path, block_size=None, journal_path=None, callback=None):
+    """
+    Copy a file by blocks of `block_size` bytes (default to :data:`DELTA_BLOCK_SIZE`), writing
+    only the blocks of the (existing) destination that differ from the source. Return the number
+    of bytes written.
+
+    Set `journal_path` to a file storing a digest of every block of the destination. The blocks are
+    compared to the digests (instead of reading the destination) if the journal is valid (the
+    destination must not be modified by other means), making the next copies (or the copy resumed
+    after an interruption) cheaper. Given `callback` is called with the bytes processed.
+
+    **Example usage**
+
+    >>> from pathlib import Path
+    >>> with TempStorage() as tmp:
+    ...     source = Path(tmp.create_tmp_file(return_file=False))
+    ...     destination, journal = source.with_suffix('.copy'), source.with_suffix('.journal')
+    ...     _ = source.write_bytes(b'a' * 10000)
+    ...     delta_copy(source, destination, block_size=1024, journal_path=journal)
+    ...     _ = source.write_bytes(b'header' + b'a' * 9994 + b'tail')
+    ...     delta_copy(source, destination, block_size=1024, journal_path=journal)
+    ...     delta_copy(source, destination, block_size=1024)
+    ...     destination.read_bytes() == source.read_bytes()
+    10000
+    1812
+    0
+    True
+    """
+    block_size = block_size or DELTA_BLOCK_SIZE
+    buffer = memoryview(bytearray(block_size))
+    offset = written = 0
+    with open(source_path, 'rb', buffering=0) as src_file, \
+            open(os.open(destination_path, os.O_RDWR | os.O_CREAT, 0o666), 'r+b', buffering=0) \
+            as dst_file:
+        dst_fd = dst_file.fileno()
+        journal = None
+        if journal_path:
+            journal = _DeltaJournal(journal_path, block_size, os.fstat(dst_fd).st_ino)
+        try:
+            while length := src_file.readinto(buffer):
+                block, index = buffer[:length], offset // block_size
+                digest = known = None
+                if journal is not None:
+                    digest, known = journal.digest(block), journal.get(index)
+                if known is None:
+                    same = os.pread(dst_fd, length, offset) == block
+                else:
+                    same = known == digest
+                if not same:
+                    _pwrite(dst_fd, block, offset)
+                    written += length
+                # Stored once the block is written, an interrupted copy is rewriting the block
+                if digest is not None and digest != known:
+                    journal.set(index, digest)
+                offset += length
+                if callback is not None:
+                    callback(length)
+            dst_file.truncate(offset)
+        finally:
+            if journal is not None:
+                journal.close(-(-offset // block_size))
+    return written
+
+
+def find_recursive(
+    directory,
+    patterns,
+    regex=False,
+    exclude=None,
+    max_depth=None,
+    ignore=None,
+    **walk_kwargs
+):
     """
     Yield filenames matching any of the patterns.
-    Patterns will be compiled to regular expressions, if necessary.
+    Patterns will be merged and compiled to regular expressions, if necessary (see
+    :class:`pytoolbox.regex.PathMatcher`).
 
     If `regex` is set to True, then any string pattern will be converted from the unix-style
     wildcard to the regular expression equivalent using :func:`fnatmch.translate`.
 
+    Set `exclude`, `max_depth` and `ignore` to prune the tree, see :func:`scandir_recursive`.
+
     **Example usage**
 
     >>> import re
@@ -59,18 +210,27 @@ def find_recursive(directory, patterns, regex=False, **walk_kwargs):
     True
     >>> [Path(f).name for f in sorted(a_files)]
     ['storage.py', 'states.py', 'string.py']
+    >>> sorted(Path(f).name for f in find_recursive(directory, '*/s*.py', max_depth=0))
+    ['serialization.py', 'setuptools.py', 'signals.py', 'states.py', 'string.py', 'subprocess.py']
     """
-    patterns = from_path_patterns(patterns, regex=regex)
-    for dirpath, _, filenames in os.walk(directory, **walk_kwargs):
-        for filename in filenames:
-            filename = os.path.join(dirpath, filename)
-            if any(p.match(filename) for p in patterns):
-                yield filename
+    matcher = PathMatcher(patterns, regex=regex)
+    for entry in scandir_recursive(directory, exclude, max_depth, ignore, regex, **walk_kwargs):
+        if matcher.match(entry.path):
+            yield entry.path
 
 
-def file_mime(path, mime=True):
+def file_mime(path, mime=True, cache=None, header_size=None):
     """
-    Return file mime type.
+    Return file mime type (or description if `mime` is False) or None in case of error.
+
+    The type is detected by the instance of :class:`magic.Magic` of the calling thread (libmagic
+    is loaded once per thread) from the first `header_size` bytes (default to
+    :data:`MIME_HEADER_SIZE`). The common media types (see :data:`MIME_SIGNATURES`) are detected
+    without calling libmagic, their types are those of the signatures whatever the version of
+    libmagic.
+
+    Set `cache` to a mapping (e.g. a dictionary) to cache the results by device, inode,
+    modification time and size of the header.
 
     **Example usage**
 
@@ -84,11 +244,56 @@ def file_mime(path, mime=True):
     True
     >>> file_mime('missing-file') is None
     True
+    >>> cache = {}
+    >>> file_mime(directory / '..' / 'setup.cfg', cache=cache)
+    'text/plain'
+    >>> list(cache.values())
+    ['text/plain']
     """
     try:
-        return magic.from_file(str(path), mime=mime)
+        stat = os.stat(path)
+        header_size = header_size or MIME_HEADER_SIZE
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, mime, header_size)
+        if cache is not None and (value := cache.get(key)) is not None:
+            return value
+        if S_ISREG(stat.st_mode) and stat.st_size:
+            with open(path, 'rb') as f:
+                header = f.read(header_size)
+            value = _get_signature_mime(path, header) if mime else None
+            value = value or _get_magic(mime).from_buffer(header)
+        else:
+            value = _get_magic(mime).from_file(os.fspath(path))  # Empty file, device, ...
     except OSError:
         return None
+    if cache is not None:
+        cache[key] = value
+    return value
+
+
+def files_mimes(paths, mime=True, cache=None, header_size=None, max_workers=1):
+    """
+    Yield a tuple (path, mime type) for every path in `paths`, see :func:`file_mime`.
+
+    Set `max_workers` to detect the types with a pool of threads (an instance of
+    :class:`magic.Magic` per thread), the paths are yielded in order.
+
+    **Example usage**
+
+    >>> from pathlib import Path
+    >>>
+    >>> directory = Path(__file__).resolve().parent / '..'
+    >>>
+    >>> list(files_mimes([directory / 'setup.cfg', 'missing-file'], max_workers=2))
+    [(PosixPath('.../setup.cfg'), 'text/plain'), ('missing-file', None)]
+    """
+    def get_mime(path):
+        return path, file_mime(path, mime, cache, header_size)
+
+    if max_workers == 1:
+        yield from (get_mime(path) for path in paths)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            yield from executor.map(get_mime, paths)
 
 
 def first_that_exist(*paths):
@@ -116,7 +321,7 @@ def first_that_exist(*paths):
     return None
 
 
-def from_template(
+def from_template(  # pylint:disable=too-many-arguments
     template,
     destination,
     values,
@@ -124,7 +329,9 @@ def from_template(
     jinja2=False,
     pre_func=None,
     post_func=None,
-    directories='.'
+    directories='.',
+    cache=True,
+    bytecode_directory=None
 ):
     """
     Return a `template` rendered with `values` using string.format or Jinja2 as the template engine.
@@ -133,6 +340,9 @@ def from_template(
     * Set `is_file` to False to use value of `template` as the content and not a filename to read.
     * Set `{pre,post}_func` to a callback function with the signature f(content, values, jinja2)
     * Set `directories` to the paths where the Jinja2 loader will lookup for *base* templates.
+    * Set `cache` to False to not reuse the Jinja2 environments (by directories) and the compiled
+      templates (by content). The *base* templates are reloaded when modified.
+    * Set `bytecode_directory` to a directory where to cache the bytecode of the *base* templates.
 
     **Example usage**
 
@@ -177,10 +387,16 @@ def from_template(
     if pre_func:
         content = pre_func(content, values=values, jinja2=jinja2)
     if jinja2:
-        from jinja2 import Environment, FileSystemLoader, StrictUndefined
-        loader = FileSystemLoader(directories)
-        environment = Environment(loader=loader, undefined=StrictUndefined)
-        content = environment.from_string(content).render(**values)
+        if isinstance(directories, (list, tuple)):
+            directories = tuple(os.fspath(d) for d in directories)
+        else:
+            directories = os.fspath(directories)
+        if cache:
+            template = _get_jinja2_template(content, directories, bytecode_directory)
+        else:
+            environment = _create_jinja2_environment(directories, bytecode_directory)
+            template = environment.from_string(content)
+        content = template.render(**values)
     else:
         content = content.format(**values)
     if post_func:
@@ -208,12 +424,18 @@ def get_bytes(path_or_data, encoding='utf-8', is_path=False, chunk_size=None):
         yield path_or_data.encode(encoding) if isinstance(path_or_data, str) else path_or_data
 
 
-def get_size(path, patterns='*', regex=False, **walk_kwargs):
+def get_size(path, patterns='*', regex=False, max_workers=1, hardlinks=True, **walk_kwargs):
     """
     Returns the size of a file or directory.
 
     If given `path` is a directory (or symlink to a directory), then returned value is computed by
-    summing the size of all files, and that recursively.
+    summing the size of all files, and that recursively. The directories are scanned with
+    :func:`os.scandir` (a single stat per file) and by a pool of `max_workers` threads, a directory
+    per task, which is way faster on network file systems.
+
+    Set `hardlinks` to False to count the files hard-linked multiple times only once (by inode).
+    The `walk_kwargs` are those of :func:`os.walk` (`followlinks` and `onerror`), `topdown` is
+    accepted only if true. Raise a :class:`TypeError` for any other argument.
 
     **Example usage**
 
@@ -227,12 +449,45 @@ def get_size(path, patterns='*', regex=False, **walk_kwargs):
     True
     >>> get_size(directory / '..', '.*/v[^/]+\\.py', regex=True) > 10000
     True
+    >>> get_size(directory, max_workers=4) == get_size(directory)
+    True
+    >>> get_size(directory, followlinks=True, topdown=False)
+    Traceback (most recent call last):
+        ...
+    TypeError: get_size() scans the directories top-down only
     """
+    followlinks, onerror = _get_walk_arguments('get_size', walk_kwargs)
     if os.path.isfile(path):
         return os.stat(path).st_size
-    return sum(
-        os.stat(f).st_size
-        for f in find_recursive(path, patterns, regex=regex, **walk_kwargs))
+    scan = functools.partial(
+        _scan_directory,
+        matcher=PathMatcher(patterns, regex=regex),
+        hardlinks=hardlinks,
+        followlinks=followlinks,
+        onerror=onerror)
+    size, linked = 0, {}
+
+    def add(result):
+        nonlocal size
+        directory_size, directory_linked, directories = result
+        size += directory_size
+        linked.update(directory_linked)
+        return directories
+
+    if max_workers == 1:
+        directories = [path]
+        while directories:
+            directories += add(scan(directories.pop()))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(scan, path)}
+            while futures:
+                done, futures = concurrent.futures.wait(
+                    futures,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    futures.update(executor.submit(scan, d) for d in add(future.result()))
+    return size + sum(linked.values())
 
 
 def makedirs(path, mode=0o777, parent=False):
@@ -279,22 +534,34 @@ def makedirs(path, mode=0o777, parent=False):
         raise  # Re-raise exception if a different error occurred
 
 
-def recursive_copy(  # pylint:disable=too-many-locals
+def recursive_copy(  # pylint:disable=too-many-arguments,too-many-locals
     source_path,
     destination_path,
     progress_callback=None,
     ratio_delta=0.01,
     time_delta=1,
     check_size=True,
-    remove_on_error=True
+    remove_on_error=True,
+    max_workers=None,
+    delta=False,
+    journal_directory=None
 ):
     """
     Copy the content of a source directory to a destination directory.
-    This function is based on a block-copy algorithm making progress update possible.
 
-    Given `progress_callback` will be called with *start_date*, *elapsed_time*, *eta_time*,
-    *src_size*, *dst_size* and *ratio*. Set `remove_on_error` to remove the destination directory
-    in case of error.
+    The files are copied concurrently by a pool of `max_workers` threads (default to the one of
+    :class:`concurrent.futures.ThreadPoolExecutor`) and by the kernel when possible: a reflink if
+    the file system supports it (e.g. Btrfs, XFS), else :func:`os.copy_file_range` or
+    :func:`os.sendfile` and finally a block-copy as a last resort.
+
+    Set `delta` to True to update an existing destination (or resume an interrupted copy): the
+    files with the same size and modification time are skipped and the others are copied by
+    :func:`delta_copy` (then their modification time is set to the one of the source). Set
+    `journal_directory` to keep the journals of the delta copies in this directory.
+
+    Given `progress_callback` will be called (by the calling thread) with *start_date*,
+    *elapsed_time*, *eta_time*, *src_size*, *dst_size* and *ratio*. Set `remove_on_error` to remove
+    the destination directory in case of error (not when resuming a delta copy).
 
     This function will return a dictionary containing *start_date*, *elapsed_time* and *src_size*.
     At the end of the copy, if the size of the destination directory is not equal to the source
@@ -302,28 +569,45 @@ def recursive_copy(  # pylint:disable=too-many-locals
     """
     try:
         start_date, start_time = datetime_now(), time.time()
-        src_size, dst_size = get_size(source_path), 0
 
-        # Recursive copy of a directory of files
+        # List the files to copy and create the directories (including empty ones)
+        files, src_size = [], 0
         for src_root, _, filenames in os.walk(source_path):
+            dst_root = os.path.join(destination_path, os.path.relpath(src_root, source_path))
+            makedirs(dst_root)
             for filename in filenames:
-                dst_root = src_root.replace(source_path, destination_path)
                 src_path = os.path.join(src_root, filename)
-                dst_path = os.path.join(dst_root, filename)
-
-                # Initialize block-based copy
-                makedirs(os.path.dirname(dst_path))
-                block_size = 1024 * 1024
-                src_file = open(src_path, 'rb')  # pylint: disable=consider-using-with
-                dst_file = open(dst_path, 'wb')  # pylint: disable=consider-using-with
-
-                # Block-based copy loop
-                block_pos = prev_ratio = prev_time = 0
-                while True:
-                    block = src_file.read(block_size)
+                files.append((src_path, os.path.join(dst_root, filename)))
+                src_size += os.stat(src_path).st_size
+
+        copied, lock = [0], threading.Lock()
+
+        def on_copy(length):
+            with lock:
+                copied[0] += length
+
+        def delta_copy_file(src_path, dst_path, callback):
+            journal_path = None
+            if journal_directory:
+                journal_path = os.path.join(
+                    journal_directory,
+                    os.path.relpath(dst_path, destination_path) + '.journal')
+                makedirs(journal_path, parent=True)
+            return _delta_copy_file(src_path, dst_path, callback, journal_path)
+
+        copy_file = delta_copy_file if delta else _copy_file
+        dst_size = prev_ratio = prev_time = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(copy_file, *paths, on_copy) for paths in files}
+            try:
+                while futures:
+                    done, futures = concurrent.futures.wait(
+                        futures,
+                        timeout=time_delta if progress_callback else None,
+                        return_when=concurrent.futures.FIRST_EXCEPTION)
+                    dst_size += sum(future.result() for future in done)
                     try:
-                        ratio = float(dst_size) / src_size
-                        ratio = 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
+                        ratio = min(max(float(copied[0]) / src_size, 0.0), 1.0)
                     except ZeroDivisionError:
                         ratio = 1.0
                     elapsed_time = time.time() - start_time
@@ -342,31 +626,21 @@ def recursive_copy(  # pylint:disable=too-many-locals
                             elapsed_time,
                             eta_time,
                             src_size,
-                            dst_size,
+                            copied[0],
                             ratio)
-
-                    block_length = len(block)
-                    block_pos += block_length
-                    dst_size += block_length
-
-                    if not block:
-                        break  # End of input reached
-
-                    dst_file.write(block)
-
-                # FIXME maybe a finally block for that
-                src_file.close()
-                dst_file.close()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
 
         # Output directory sanity check
-        if check_size:
-            if (dst_size := get_size(destination_path)) != src_size:
-                raise IOError(f'Destination size does not match source ({src_size} vs {dst_size})')
+        if check_size and dst_size != src_size:
+            raise IOError(f'Destination size does not match source ({src_size} vs {dst_size})')
 
         elapsed_time = time.time() - start_time
         return {'start_date': start_date, 'elapsed_time': elapsed_time, 'src_size': src_size}
     except Exception:
-        if remove_on_error:
+        if remove_on_error and not delta:
             shutil.rmtree(destination_path, ignore_errors=True)
         raise
 
@@ -425,6 +699,82 @@ def remove(path, recursive=False):
         raise  # Re-raise exception if a different error occurred
 
 
+def scandir_recursive(
+    directory,
+    exclude=None,
+    max_depth=None,
+    ignore=None,
+    regex=False,
+    followlinks=False,
+    onerror=None,
+    **walk_kwargs
+):
+    """
+    Yield an instance of :class:`os.DirEntry` for every file (anything but a directory) of
+    `directory`, recursively, the files of a directory before its sub-directories.
+    The directories are pruned (their tree is never scanned) by:
+
+    * `exclude`: Patterns of the paths to skip (see :class:`pytoolbox.regex.PathMatcher`).
+    * `max_depth`: Maximum depth of the directories to scan (0 to scan only `directory`).
+    * `ignore`: An :class:`IgnoreSpec` or the lines of a *.gitignore* file (paths relative to
+      `directory`).
+
+    The `followlinks` and `onerror` arguments are those of :func:`os.walk`, `topdown` is accepted
+    only if true. Raise a :class:`TypeError` for any other argument.
+
+    **Example usage**
+
+    >>> from pathlib import Path
+    >>>
+    >>> directory = Path(__file__).resolve().parent
+    >>>
+    >>> names = {e.name for e in scandir_recursive(directory, ['*/multimedia', '*.pyc'])}
+    >>> 'filesystem.py' in names, 'ffprobe.py' in names, 'crypto.py' in names
+    (True, False, True)
+    >>> names = {e.name for e in scandir_recursive(directory, ignore=['/*/', '!/aws/', 'c*'])}
+    >>> 'filesystem.py' in names, 's3.py' in names, 'crypto.py' in names, 'ffprobe.py' in names
+    (True, True, False, False)
+    >>> next(scandir_recursive(directory, topdown=False))
+    Traceback (most recent call last):
+        ...
+    TypeError: scandir_recursive() scans the directories top-down only
+    """
+    _get_walk_arguments('scandir_recursive', walk_kwargs)
+    exclude = PathMatcher(exclude, regex=regex) if exclude else None
+    if ignore is not None and not isinstance(ignore, IgnoreSpec):
+        ignore = IgnoreSpec(ignore)
+    directory = os.fspath(directory)
+    prefix_length = len(os.path.join(directory, ''))
+    directories = [(directory, 0)]
+    while directories:
+        path, depth = directories.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError as ex:
+            if onerror is not None:
+                onerror(ex)
+            continue
+        sub_directories = []
+        with entries:
+            for entry in entries:
+                if exclude is not None and exclude.match(entry.path):
+                    continue
+                try:
+                    is_directory = entry.is_dir()
+                except OSError:
+                    is_directory = False
+                if ignore is not None and ignore.match(entry.path[prefix_length:], is_directory):
+                    continue
+                if not is_directory:
+                    yield entry
+                elif (
+                    (max_depth is None or depth < max_depth)
+                    and (followlinks or not entry.is_symlink())
+                ):
+                    sub_directories.append((entry.path, depth + 1))
+        directories += reversed(sub_directories)
+
+
 def symlink(source, link_name):
     """
     Symlink a file/directory (which may already exists) without throwing an exception. Returns True
@@ -526,6 +876,217 @@ def to_group_id(group):
     return -1 if group is None else group
 
 
+class IgnoreSpec(object):
+    """
+    Paths to ignore, specified like a *.gitignore* file: A pattern per line, blank lines and
+    comments (#) are skipped, a leading ``!`` negates (re-includes) a pattern and a trailing
+    ``/`` matches only directories. A pattern containing a slash (not trailing) is relative to the
+    root, else it matches a name at any level. ``*`` and ``?`` do not match a slash, ``**`` matches
+    any number of directories. The last matching pattern wins.
+
+    **Example usage**
+
+    >>> spec = IgnoreSpec(['# Comment', '*.log', '!keep.log', 'build/', '/docs/*.html', 'a/**/z'])
+    >>> [spec.match(p) for p in ('x.log', 'sub/x.log', 'sub/keep.log')]
+    [True, True, False]
+    >>> spec.match('build', is_directory=True), spec.match('sub/build', is_directory=True)
+    (True, True)
+    >>> [spec.match(p) for p in ('docs/i.html', 'docs/sub/i.html', 'sub/docs/i.html')]
+    [True, False, False]
+    >>> [spec.match(p) for p in ('a/z', 'a/b/c/z', 'b/a/z')]
+    [True, True, False]
+    >>> spec.match('build', is_directory=False)
+    False
+    """
+
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            line = line[1:] if negate else line
+            directory_only = line.endswith('/')
+            line = line.rstrip('/')
+            regex = self._translate(line.lstrip('/'))
+            if '/' not in line:
+                regex = f'(?:.*/)?{regex}'
+            self.rules.append((re.compile(f'{regex}\\Z', re.DOTALL), negate, directory_only))
+
+    @classmethod
+    def from_file(cls, path):
+        """Return an instance of the class with the patterns of a *.gitignore* file."""
+        with open(path, encoding='utf-8') as f:
+            return cls(f)
+
+    def match(self, path, is_directory=False):
+        """Return True if `path` (relative to the root, with slashes) is ignored."""
+        for regex, negate, directory_only in reversed(self.rules):
+            if (is_directory or not directory_only) and regex.match(path):
+                return not negate
+        return False
+
+    @staticmethod
+    def _translate(pattern):
+        """
+        Translate a pattern to a regular expression.
+
+        **Example usage**
+
+        >>> IgnoreSpec._translate('**/a/**/b*[!c].?')
+        '(?:.*/)?a/(?:.*/)?b[^/]*[^c]\\\\.[^/]'
+        """
+        parts, index = [], 0
+        while index < len(pattern):
+            char = pattern[index]
+            if pattern.startswith('**/', index):
+                parts.append('(?:.*/)?')
+                index += 3
+                continue
+            if pattern.startswith('/**', index) and index + 3 == len(pattern):
+                parts.append('/.*')
+                index += 3
+                continue
+            if char == '*':
+                parts.append('[^/]*')
+            elif char == '?':
+                parts.append('[^/]')
+            elif char == '[' and (end := pattern.find(']', index + 2)) != -1:
+                content = pattern[index + 1:end].replace('\\', '\\\\')
+                parts.append(f'[^{content[1:]}]' if content[0] == '!' else f'[{content}]')
+                index = end
+            elif char == '\\' and index + 1 < len(pattern):
+                index += 1
+                parts.append(re.escape(pattern[index]))
+            else:
+                parts.append(re.escape(char))
+            index += 1
+        return ''.join(parts)
+
+
+ManifestChanges = collections.namedtuple('ManifestChanges', 'added removed modified')
+ManifestEntry = collections.namedtuple('ManifestEntry', 'path size mtime_ns inode checksum')
+
+
+class Manifest(object):
+    """
+    Record the state of the files of a directory (see :class:`ManifestEntry`) in a SQLite
+    database to report the files added, removed or modified since the previous scan. The changes
+    are detected from the metadata of the files (size, modification time and inode), without
+    reading their content.
+
+    Set `algorithm` (see :func:`pytoolbox.crypto.new`) to also store a checksum of the files,
+    computed only for the files added or modified. The `scan_kwargs` (e.g. `exclude`, `ignore`)
+    are passed to :func:`scandir_recursive`.
+
+    **Example usage**
+
+    >>> from pathlib import Path
+    >>> with TempStorage() as tmp, Manifest(
+    ...     directory := Path(tmp.create_tmp_directory()),
+    ...     directory / '.manifest',
+    ...     algorithm='md5'
+    ... ) as manifest:
+    ...     _ = (directory / 'a.txt').write_text('a')
+    ...     manifest.update()
+    ...     manifest.get('a.txt').checksum
+    ...     _ = (directory / 'a.txt').write_text('abc')
+    ...     _ = (directory / 'b.txt').write_text('b')
+    ...     manifest.update()
+    ...     (directory / 'a.txt').unlink()
+    ...     manifest.update()
+    ...     manifest.update()
+    ManifestChanges(added=['a.txt'], removed=[], modified=[])
+    '0cc175b9c0f1b6a831c399e269772661'
+    ManifestChanges(added=['b.txt'], removed=[], modified=['a.txt'])
+    ManifestChanges(added=[], removed=['a.txt'], modified=[])
+    ManifestChanges(added=[], removed=[], modified=[])
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            checksum TEXT
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, directory, path, algorithm=None, **scan_kwargs):
+        self.directory = os.fspath(directory)
+        self.path = os.fspath(path)
+        self.algorithm = algorithm
+        self.scan_kwargs = scan_kwargs
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(self.schema)
+
+        # The database (and its temporary files) may be stored in the directory
+        path = os.path.relpath(os.path.abspath(self.path), os.path.abspath(self.directory))
+        self._own_paths = {path + suffix for suffix in ('', '-journal', '-wal', '-shm')}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for row in self.connection.execute('SELECT * FROM files ORDER BY path'):
+            yield ManifestEntry(*row)
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, path):
+        """Return the entry (an instance of :class:`ManifestEntry`) of `path` or None."""
+        row = self.connection.execute('SELECT * FROM files WHERE path = ?', (path, )).fetchone()
+        return None if row is None else ManifestEntry(*row)
+
+    def update(self, commit=True):
+        """
+        Scan the directory and return the changes (an instance of :class:`ManifestChanges`, sorted
+        paths relative to the directory). Set `commit` to False to not update the manifest.
+        """
+        known = {
+            path: state
+            for path, *state in self.connection.execute(
+                'SELECT path, size, mtime_ns, inode FROM files')
+        }
+        prefix_length = len(os.path.join(self.directory, ''))
+        added, modified, rows = [], [], []
+        for entry in scandir_recursive(self.directory, **self.scan_kwargs):
+            if (path := entry.path[prefix_length:]) in self._own_paths:
+                continue
+            stat = entry.stat()
+            state = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+            if (previous := known.pop(path, None)) == state:
+                continue
+            (added if previous is None else modified).append(path)
+            if commit:
+                rows.append((path, *state, self._checksum(entry.path)))
+        removed = sorted(known)
+        if commit:
+            with self.connection:
+                self.connection.executemany(
+                    'DELETE FROM files WHERE path = ?',
+                    ((path, ) for path in removed))
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                    rows)
+        return ManifestChanges(sorted(added), removed, sorted(modified))
+
+    def _checksum(self, path):
+        if self.algorithm is None:
+            return None
+        from . import crypto
+        return crypto.checksum(path, is_path=True, algorithm=self.algorithm, chunk_size=1048576)
+
+
 class TempStorage(object):
     """
     Temporary storage handling made easy.
@@ -541,11 +1102,56 @@ class TempStorage(object):
     True
     >>> os.path.isdir(directory)
     False
+
+    Set `pool` to True to create the temporary files and directories in a RAM-backed file system
+    (`memory_root`, default to :data:`MEMORY_ROOT` if writable) as long as they fit in the
+    `memory_budget` (bytes, default to the space available), and spill to `root` otherwise. The
+    `size` given to the `create_tmp_*` methods is the expected size of the content, reserved in the
+    budget (see `memory_reserved`) until the path is removed. The paths of unknown size (`size` set
+    to None, the default) are created in `root`.
+
+    The removed directories are emptied and kept (at most `pool_size` per root) to be recycled by
+    the next directories created in the same root, skipping the creation and the change of owner:
+
+    >>> tmp = TempStorage(pool=True, memory_budget=1024)
+    >>> directory = tmp.create_tmp_directory(size=512)
+    >>> directory.startswith(tmp.memory_root)
+    True
+    >>> tmp.create_tmp_directory(size=2048).startswith(tmp.root)
+    True
+    >>> tmp.create_tmp_directory().startswith(tmp.root)
+    True
+    >>> tmp.remove_by_path(directory)
+    >>> os.path.isdir(directory)
+    True
+    >>> recycled = tmp.create_tmp_directory(size=512)
+    >>> os.path.isdir(directory), os.path.isdir(recycled)
+    (False, True)
+    >>> tmp.remove_all()
+    >>> os.path.isdir(recycled)
+    False
     """
-    def __init__(self, root=None):
+    def __init__(
+        self,
+        root=None,
+        pool=False,
+        memory_root=None,
+        memory_budget=None,
+        pool_size=16
+    ):
         self.root = root or tempfile.gettempdir()
+        self.memory_root = None
+        if pool:
+            self.memory_root = memory_root or (
+                MEMORY_ROOT if os.access(MEMORY_ROOT, os.W_OK) else None)
+        self.memory_budget = memory_budget
+        self.memory_reserved = 0
+        self.pool_size = pool_size if pool else 0
         self._path_to_key = {}
         self._paths_by_key = collections.defaultdict(set)
+        self._directory_to_root = {}
+        self._memory_path_to_size = {}
+        self._recycled_by_root = collections.defaultdict(list)
 
     def __enter__(self):
         return self
@@ -553,7 +1159,28 @@ class TempStorage(object):
     def __exit__(self, kind, value, traceback):
         self.remove_all()
 
-    def create_tmp_directory(self, path='tmp-{uuid}', key=None, user=None, group=None):
+    @property
+    def memory_usage(self):
+        """
+        Size (in bytes) of the temporary files and directories stored in the memory root, measured
+        on the file system (the budget is checked against `memory_reserved`).
+        """
+        size = 0
+        for path in self._memory_path_to_size:
+            try:
+                size += get_size(path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def create_tmp_directory(
+        self,
+        path='tmp-{uuid}',
+        key=None,
+        user=None,
+        group=None,
+        size=None
+    ):
         """
         **Example usage**
 
@@ -564,10 +1191,18 @@ class TempStorage(object):
         True
         >>> tmp.remove_all()
         """
-        directory = os.path.join(self.root, path.format(uuid=uuid.uuid4().hex))
+        root = self._get_root(size)
+        directory = os.path.join(root, path.format(uuid=uuid.uuid4().hex))
         self._path_to_key[directory] = key
         self._paths_by_key[key].add(directory)
-        makedirs(directory)
+        self._directory_to_root[directory] = root
+        self._reserve(directory, root, size)
+        recycled = self._recycled_by_root[root]
+        try:
+            os.rename(recycled[-1], directory)
+            recycled.pop()
+        except (IndexError, OSError):
+            makedirs(directory)
         chown(directory, user, group, recursive=True)
         return directory
 
@@ -579,7 +1214,8 @@ class TempStorage(object):
         key=None,
         user=None,
         group=None,
-        return_file=True
+        return_file=True,
+        size=None
     ):
         """
         **Example usage**
@@ -600,17 +1236,19 @@ class TempStorage(object):
         >>> tmp.remove_all()
         """
         mode = 'w' if encoding else 'wb'
+        root = self._get_root(size)
         path = os.path.join(
-            self.root,
+            root,
             path.format(uuid=uuid.uuid4().hex) + (f'.{extension}' if extension else ''))
 
         self._path_to_key[path] = key
         self._paths_by_key[key].add(path)
+        self._reserve(path, root, size)
 
-        with open(path, mode, encoding=encoding):
-            pass
-
-        chown(path, user, group)
+        with open(path, mode, encoding=encoding) as f:
+            uid, gid = to_user_id(user), to_group_id(group)
+            if _get_owner_changes(os.fstat(f.fileno()), uid, gid):
+                os.fchown(f.fileno(), uid, gid)
 
         if return_file:
             return open(path, mode, encoding=encoding)  # pylint: disable=consider-using-with
@@ -630,7 +1268,7 @@ class TempStorage(object):
         ...     tmp.remove_by_path('random-path')
         """
         key = self._path_to_key[path]
-        remove(path, recursive=True)
+        self._release(path)
         del self._path_to_key[path]
         self._paths_by_key[key].remove(path)
 
@@ -653,7 +1291,7 @@ class TempStorage(object):
         """
         paths = self._paths_by_key[key]
         for path in copy.copy(paths):
-            remove(path, recursive=True)
+            self._release(path)
             paths.remove(path)
             del self._path_to_key[path]
         del self._paths_by_key[key]
@@ -675,6 +1313,572 @@ class TempStorage(object):
         """
         for key in self._paths_by_key.copy().keys():
             self.remove_by_key(key)
+        for recycled in self._recycled_by_root.values():
+            for directory in recycled:
+                remove(directory, recursive=True)
+            recycled.clear()
+
+    def _get_root(self, size):
+        """Return the memory root if `size` bytes (known) fits in the budget, the root otherwise."""
+        if self.memory_root and size is not None:
+            available = shutil.disk_usage(self.memory_root).free
+            if self.memory_budget is not None:
+                available = min(available, self.memory_budget - self.memory_reserved)
+            if size <= available:
+                return self.memory_root
+        return self.root
+
+    def _release(self, path):
+        """Remove `path` or empty it to be recycled if it's a directory and the pool isn't full."""
+        self.memory_reserved -= self._memory_path_to_size.pop(path, 0)
+        root = self._directory_to_root.pop(path, None)
+        recycled = self._recycled_by_root[root] if root else None
+        if recycled is None or len(recycled) >= self.pool_size or not os.path.isdir(path):
+            remove(path, recursive=True)
+            return
+        with os.scandir(path) as entries:
+            for entry in entries:
+                remove(entry.path, recursive=entry.is_dir(follow_symlinks=False))
+        recycled.append(path)
+
+    def _reserve(self, path, root, size):
+        """Reserve `size` bytes of the memory budget for `path` if stored in the memory root."""
+        if root == self.memory_root:
+            self._memory_path_to_size[path] = size
+            self.memory_reserved += size
+
+
+WatchEvent = collections.namedtuple('WatchEvent', 'path flags completed')
+
+
+class WatchFlags(enum.IntFlag):
+    """Events (and options) of the inotify watches of a :class:`Watcher`, see inotify(7)."""
+
+    ACCESS = 0x00000001
+    MODIFY = 0x00000002
+    ATTRIB = 0x00000004
+    CLOSE_WRITE = 0x00000008
+    CLOSE_NOWRITE = 0x00000010
+    OPEN = 0x00000020
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    DELETE_SELF = 0x00000400
+    MOVE_SELF = 0x00000800
+    UNMOUNT = 0x00002000
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ONLYDIR = 0x01000000
+    DONT_FOLLOW = 0x02000000
+    EXCL_UNLINK = 0x04000000
+    MASK_ADD = 0x20000000
+    ISDIR = 0x40000000
+    ONESHOT = 0x80000000
+
+    #: Changes of the content and of the tree (default of :class:`Watcher`)
+    CHANGES = (
+        MODIFY | ATTRIB | CLOSE_WRITE | MOVED_FROM | MOVED_TO | CREATE | DELETE | DELETE_SELF
+        | MOVE_SELF)
+
+
+class Watcher(object):
+    """
+    Watch files and directories for the events `flags` with inotify (Linux only, the C library is
+    called with ctypes) instead of polling them.
+
+    The events of a path are coalesced (their flags combined) until the path is left unchanged for
+    `delay` seconds, then yielded as a :class:`WatchEvent`. The event is `completed` if the last
+    change of the file is that it was closed after being written or moved in the watched tree.
+
+    The directories added with `recursive` set to True are watched with their sub-directories,
+    including those created (or moved in) later, whose entries are reported as created (or moved
+    in) because they may precede the watch. The paths matching `exclude` are neither watched nor
+    reported (see :class:`pytoolbox.regex.PathMatcher`).
+
+    An event with no path and the flag Q_OVERFLOW is yielded if the queue of the kernel overflowed,
+    some events are lost and the tree should be scanned.
+
+    **Example usage**
+
+    >>> from pathlib import Path
+    >>> with TempStorage() as tmp, Watcher(delay=0.05) as watcher:
+    ...     directory = Path(tmp.create_tmp_directory())
+    ...     watcher.add(directory, recursive=True)
+    ...     (directory / 'sub').mkdir()
+    ...     for event in watcher.events(timeout=0.1):
+    ...         print(Path(event.path).relative_to(directory), event.completed)
+    ...     with open(directory / 'sub' / 'a.txt', 'w', encoding='utf-8') as f:
+    ...         for line in range(3):
+    ...             _ = f.write(f'line {line}\\n')
+    ...             f.flush()
+    ...     for event in watcher.events(timeout=0.1):
+    ...         print(Path(event.path).relative_to(directory), event.completed)
+    sub False
+    sub/a.txt True
+    """
+    def __init__(self, flags=WatchFlags.CHANGES, delay=0.1, exclude=None, regex=False):
+        self.flags = WatchFlags(flags)
+        self.delay = delay
+        self.exclude = PathMatcher(exclude, regex=regex) if exclude else None
+        self.descriptor = _inotify('init1', os.O_NONBLOCK | os.O_CLOEXEC)
+        self._paths = {}
+        self._watches = {}
+        self._recursive = set()
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self.events()
+
+    def __aiter__(self):
+        return self.events_async()
+
+    @property
+    def paths(self):
+        """The watched paths."""
+        return set(self._watches)
+
+    def add(self, path, recursive=False):
+        """Watch `path` (and its sub-directories if `recursive`)."""
+        path = os.fspath(path)
+        self._add_watch(path, recursive)
+        if recursive and os.path.isdir(path):
+            self._add_tree(path)
+
+    def remove(self, path):
+        """Stop watching `path` and its sub-directories (if watched)."""
+        path = os.fspath(path)
+        prefix = os.path.join(path, '')
+        for watch, other_path in list(self._paths.items()):
+            if other_path == path or other_path.startswith(prefix):
+                self._forget(watch)
+                try:
+                    _inotify('rm_watch', self.descriptor, watch)
+                except OSError as ex:
+                    if ex.errno != errno.EINVAL:  # Already removed by the kernel
+                        raise
+
+    def close(self):
+        if self.descriptor is not None:
+            os.close(self.descriptor)
+            self.descriptor = None
+
+    def fileno(self):
+        return self.descriptor
+
+    def events(self, timeout=None):
+        """
+        Yield the events, forever or until nothing happened for `timeout` seconds (and the pending
+        events are yielded).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.descriptor, selectors.EVENT_READ)
+            while True:
+                yield from self._pop_events()
+                if self._is_expired(deadline):
+                    return
+                if selector.select(self._get_timeout(deadline)):
+                    self._read()
+                    deadline = None if timeout is None else time.monotonic() + timeout
+
+    async def events_async(self, timeout=None):
+        """Asynchronous version of :meth:`events`, the events are read by the running event loop."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.descriptor, readable.set)
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                for event in self._pop_events():
+                    yield event
+                if self._is_expired(deadline):
+                    return
+                try:
+                    await asyncio.wait_for(readable.wait(), self._get_timeout(deadline))
+                except asyncio.TimeoutError:
+                    continue
+                readable.clear()
+                self._read()
+                deadline = None if timeout is None else time.monotonic() + timeout
+        finally:
+            loop.remove_reader(self.descriptor)
+
+    def _add_watch(self, path, recursive):
+        mask = self.flags | (WatchFlags.CREATE | WatchFlags.MOVED_TO if recursive else 0)
+        watch = _inotify('add_watch', self.descriptor, os.fsencode(path), mask)
+        previous = self._paths.get(watch)
+        if previous is not None and previous != path:
+            # Directory moved in the tree, the watch (and those of its sub-directories) is kept
+            prefix = os.path.join(previous, '')
+            for other, other_path in list(self._paths.items()):
+                if other_path == previous or other_path.startswith(prefix):
+                    self._forget(other, keep=True)
+                    self._paths[other] = path + other_path[len(previous):]
+                    self._watches[self._paths[other]] = other
+        self._paths[watch] = path
+        self._watches[path] = watch
+        if recursive:
+            self._recursive.add(watch)
+
+    def _add_tree(self, directory, flags=0):
+        """Watch the sub-directories of `directory` and queue an event with `flags` per entry."""
+        directories = [directory]
+        while directories:
+            try:
+                entries = os.scandir(directories.pop())
+            except OSError:
+                continue  # Removed meanwhile
+            with entries:
+                for entry in entries:
+                    if self.exclude is not None and self.exclude.match(entry.path):
+                        continue
+                    if is_directory := entry.is_dir(follow_symlinks=False):
+                        try:
+                            self._add_watch(entry.path, recursive=True)
+                        except OSError:
+                            continue  # Removed meanwhile
+                        directories.append(entry.path)
+                    if flags:
+                        self._queue(entry.path, flags | (WatchFlags.ISDIR if is_directory else 0))
+
+    def _forget(self, watch, keep=False):
+        path = self._paths.pop(watch)
+        if self._watches.get(path) == watch:
+            del self._watches[path]
+        if not keep:
+            self._recursive.discard(watch)
+
+    def _get_timeout(self, deadline):
+        """Return the time to wait for events (None to wait forever)."""
+        now = time.monotonic()
+        if self._pending:
+            return max(0, next(iter(self._pending.values()))[2] - now)
+        return None if deadline is None else max(0, deadline - now)
+
+    def _is_expired(self, deadline):
+        return not self._pending and deadline is not None and time.monotonic() >= deadline
+
+    def _pop_events(self):
+        """Yield the pending events whose path is left unchanged for `delay` seconds."""
+        now = time.monotonic()
+        for path, (flags, last_flags, deadline) in list(self._pending.items()):
+            if deadline > now:
+                break
+            del self._pending[path]
+            completed = bool(
+                last_flags & (WatchFlags.CLOSE_WRITE | WatchFlags.MOVED_TO)
+                and not last_flags & WatchFlags.ISDIR)
+            yield WatchEvent(path, WatchFlags(flags), completed)
+
+    def _queue(self, path, flags):
+        if flags & (self.flags | WatchFlags.Q_OVERFLOW):
+            # Moved at the end, the pending events are sorted by deadline
+            previous_flags = self._pending.pop(path, (0,))[0]
+            deadline = 0 if path is None else time.monotonic() + self.delay
+            self._pending[path] = (previous_flags | flags, flags, deadline)
+
+    def _read(self):
+        """Read the events available and queue them."""
+        while True:
+            try:
+                data = os.read(self.descriptor, _INOTIFY_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                watch, flags, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if flags & WatchFlags.Q_OVERFLOW:
+                    self._queue(None, flags)
+                elif (directory := self._paths.get(watch)) is None:
+                    continue  # Watch removed meanwhile
+                elif flags & WatchFlags.IGNORED:
+                    self._forget(watch)
+                else:
+                    self._handle(watch, os.path.join(directory, os.fsdecode(name)), flags)
+
+    def _handle(self, watch, path, flags):
+        path = path.rstrip(os.sep)
+        if self.exclude is not None and self.exclude.match(path):
+            return
+        moved_in = flags & (WatchFlags.CREATE | WatchFlags.MOVED_TO)
+        if moved_in and flags & WatchFlags.ISDIR and watch in self._recursive:
+            try:
+                self._add_watch(path, recursive=True)
+            except OSError:
+                pass  # Removed meanwhile
+            else:
+                self._add_tree(path, moved_in)
+        self._queue(path, flags)
+
+
+# Delta copy of files ------------------------------------------------------------------------------
+
+class _DeltaJournal(object):
+    """
+    The digests of the blocks of the destination of :func:`delta_copy` stored in a file: A header
+    (magic, size of the blocks and inode of the destination) followed by a digest per block.
+    The journal is reset if the header does not match.
+    """
+
+    digest_size = 16
+    header = struct.Struct('<8sQQ')
+    magic = b'PTBDELTA'
+
+    def __init__(self, path, block_size, inode):
+        self.file_descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        header = self.header.pack(self.magic, block_size, inode)
+        if os.pread(self.file_descriptor, self.header.size, 0) == header:
+            size = os.fstat(self.file_descriptor).st_size
+            data = os.pread(self.file_descriptor, size, self.header.size)
+            self.digests = [
+                data[i:i + self.digest_size]
+                for i in range(0, len(data) - len(data) % self.digest_size, self.digest_size)
+            ]
+        else:
+            os.ftruncate(self.file_descriptor, 0)
+            _pwrite(self.file_descriptor, header, 0)
+            self.digests = []
+
+    def close(self, count):
+        """Keep the digests of the first `count` blocks and close the journal."""
+        os.ftruncate(self.file_descriptor, self.header.size + count * self.digest_size)
+        os.close(self.file_descriptor)
+
+    def digest(self, block):
+        return hashlib.blake2b(block, digest_size=self.digest_size).digest()
+
+    def get(self, index):
+        return self.digests[index] if index < len(self.digests) else None
+
+    def set(self, index, digest):
+        _pwrite(self.file_descriptor, digest, self.header.size + index * self.digest_size)
+        if index < len(self.digests):
+            self.digests[index] = digest
+        else:
+            self.digests.append(digest)
+
+
+def _pwrite(file_descriptor, data, offset):
+    """Write all the `data` at given `offset` of the file."""
+    data = memoryview(data)
+    while data:
+        length = os.pwrite(file_descriptor, data, offset)
+        data, offset = data[length:], offset + length
+
+
+# Owner of files -----------------------------------------------------------------------------------
+
+def _chown_entries(dir_fd, names, uid, gid, follow_symlinks):
+    """Change the owner of the entries `names` of a directory not already owned by uid/gid."""
+    for name in names:
+        try:
+            stat = os.stat(name, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
+        except FileNotFoundError:
+            continue
+        if _get_owner_changes(stat, uid, gid):
+            os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
+
+
+def _get_owner_changes(stat, uid, gid):
+    return uid not in (-1, stat.st_uid) or gid not in (-1, stat.st_gid)
+
+
+# Copy of files ------------------------------------------------------------------------------------
+
+_FICLONE = 0x40049409  # ioctl(dst_fd, FICLONE, src_fd) from linux/fs.h
+_COPY_BLOCK_SIZE = 1024 * 1024
+_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+_COPY_FALLBACK_ERRNOS = {errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV}
+
+
+def _copy_file(source_path, destination_path, callback):
+    """
+    Copy a file, reporting the bytes copied to `callback` and return the size of the destination.
+    Try a reflink then copy by the kernel, falling back to a block-copy.
+    """
+    with open(source_path, 'rb', buffering=0) as src_file, \
+            open(destination_path, 'wb', buffering=0) as dst_file:
+        src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+        try:
+            fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+        except OSError:
+            pass
+        else:
+            size = os.fstat(dst_fd).st_size
+            callback(size)
+            return size
+        # Copy from the current positions (that every function is advancing) until the end
+        for function in _copy_functions:
+            try:
+                while length := function(src_fd, dst_fd):
+                    callback(length)
+                break
+            except OSError as ex:
+                if ex.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+        return os.fstat(dst_fd).st_size
+
+
+def _delta_copy_file(source_path, destination_path, callback, journal_path=None):
+    """
+    Copy a file with :func:`delta_copy` unless the destination has the same size and modification
+    time, set the modification time of the destination and return its size.
+    """
+    src_stat = os.stat(source_path)
+    try:
+        dst_stat = os.stat(destination_path)
+    except FileNotFoundError:
+        dst_stat = None
+    if dst_stat and (dst_stat.st_size, dst_stat.st_mtime_ns) == \
+            (src_stat.st_size, src_stat.st_mtime_ns):
+        callback(dst_stat.st_size)
+        return dst_stat.st_size
+    delta_copy(source_path, destination_path, journal_path=journal_path, callback=callback)
+    os.utime(destination_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return os.stat(destination_path).st_size
+
+
+def _copy_file_range(src_fd, dst_fd):
+    return os.copy_file_range(src_fd, dst_fd, _COPY_CHUNK_SIZE)
+
+
+def _copy_sendfile(src_fd, dst_fd):
+    return os.sendfile(dst_fd, src_fd, None, _COPY_CHUNK_SIZE)
+
+
+def _copy_block(src_fd, dst_fd):
+    block = memoryview(os.read(src_fd, _COPY_BLOCK_SIZE))
+    length = len(block)
+    while block:
+        block = block[os.write(dst_fd, block):]
+    return length
+
+
+_copy_functions = (
+    *([_copy_file_range] if hasattr(os, 'copy_file_range') else []),
+    *([_copy_sendfile] if hasattr(os, 'sendfile') else []),
+    _copy_block
+)
+
+
+# Size of files ------------------------------------------------------------------------------------
+
+def _get_walk_arguments(function, walk_kwargs):
+    """
+    Return the `followlinks` and `onerror` arguments of :func:`os.walk` from `walk_kwargs`.
+    Raise a :class:`TypeError` for any other argument (`topdown` is accepted only if true).
+    """
+    walk_kwargs = dict(walk_kwargs)
+    followlinks, onerror = walk_kwargs.pop('followlinks', False), walk_kwargs.pop('onerror', None)
+    if not walk_kwargs.pop('topdown', True):
+        raise TypeError(f'{function}() scans the directories top-down only')
+    if walk_kwargs:
+        raise TypeError(f"{function}() got unsupported keyword arguments: {', '.join(walk_kwargs)}")
+    return followlinks, onerror
+
+
+def _scan_directory(directory, matcher, hardlinks=True, followlinks=False, onerror=None):
+    """
+    Return a tuple with the size of the files of `directory` matched by `matcher`, a
+    dictionary (device, inode) -> size of the files linked multiple times (if `hardlinks` is False,
+    excluded from the size) and the sub-directories to scan (same rules as :func:`os.walk`).
+    """
+    size, linked, directories = 0, {}, []
+    try:
+        entries = os.scandir(directory)
+    except OSError as ex:
+        if onerror is not None:
+            onerror(ex)
+        return size, linked, directories
+    with entries:
+        for entry in entries:
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                is_directory = False
+            if is_directory:
+                if followlinks or not entry.is_symlink():
+                    directories.append(entry.path)
+            elif matcher.match(entry.path):
+                stat = entry.stat()
+                if not hardlinks and stat.st_nlink > 1:
+                    linked[(stat.st_dev, stat.st_ino)] = stat.st_size
+                else:
+                    size += stat.st_size
+    return size, linked, directories
+
+
+# Templates ----------------------------------------------------------------------------------------
+
+def _create_jinja2_environment(directories, bytecode_directory=None):
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, StrictUndefined
+    return Environment(
+        loader=FileSystemLoader(directories),
+        undefined=StrictUndefined,
+        bytecode_cache=FileSystemBytecodeCache(bytecode_directory) if bytecode_directory else None)
+
+
+_get_jinja2_environment = functools.lru_cache(maxsize=None)(_create_jinja2_environment)
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_jinja2_template(content, directories, bytecode_directory=None):
+    return _get_jinja2_environment(directories, bytecode_directory).from_string(content)
+
+
+# Type of files ------------------------------------------------------------------------------------
+
+_magic = threading.local()
+
+
+def _get_magic(mime):
+    """Return the instance of :class:`magic.Magic` of the calling thread."""
+    instances = _magic.__dict__.setdefault('instances', {})
+    if (instance := instances.get(mime)) is None:
+        instance = instances[mime] = magic.Magic(mime=mime)
+    return instance
+
+
+def _get_signature_mime(path, header):
+    """Return the mime type of a file from its extension and signature (if known) or None."""
+    if signature := MIME_SIGNATURES.get(os.path.splitext(path)[1].lower()):
+        regex, mime = signature
+        if regex.match(header):
+            return mime
+    return None
+
+
+# Watch of files -----------------------------------------------------------------------------------
+
+_INOTIFY_BUFFER_SIZE = 64 * 1024
+_INOTIFY_EVENT = struct.Struct('iIII')  # struct inotify_event without the name
+
+
+@functools.lru_cache(maxsize=None)
+def _get_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _inotify(name, *args):
+    """Call the inotify function `name` of the C library, raise an :class:`OSError` on failure."""
+    if (result := getattr(_get_libc(), f'inotify_{name}')(*args)) == -1:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
 
 
 __all__ = _all.diff(globals())
@@ -2,4 +2,5 @@ from .encode import *         # noqa:F401,F403
 from .ffmpeg import *         # noqa:F401,F403
 from .ffprobe import *        # noqa:F401,F403
 from .miscellaneous import *  # noqa:F401,F403
+from .pool import *           # noqa:F401,F403
 from .utils import *          # noqa:F401,F403
@@ -0,0 +1,310 @@
+"""
+Benchmark the FFmpeg wrappers with inputs generated by FFmpeg (*lavfi* testsrc and sine sources).
+
+The wrappers are measured (wall time and CPU time of the calling process) and compared to the
+same commands called directly, the difference being the overhead of the wrappers and the direct
+calls the time spent by FFmpeg (spawn and codecs). The memory allocated by the calling process is
+traced during a dedicated run (to not slow down the measures).
+
+Results are JSON serializable to be diffed across releases::
+
+    python -m pytoolbox.multimedia.ffmpeg.benchmark --duration 10 --output results.json
+"""
+# pylint:disable=protected-access,too-few-public-methods
+import argparse, io, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+from pathlib import Path
+from statistics import median
+
+import pytoolbox
+from . import encode, ffmpeg, ffprobe, miscellaneous, pool
+
+__all__ = [
+    'benchmark_encode',
+    'benchmark_frames_checksum',
+    'benchmark_get_media_info',
+    'benchmark_mpd',
+    'benchmark_pool',
+    'benchmark_spawn',
+    'generate_input',
+    'get_encoder_class',
+    'main',
+    'measure',
+    'run'
+]
+
+
+def get_encoder_class(executable=None, ffprobe_executable=None):
+    """Return a subclass of :class:`FFmpeg` (and FFprobe, statistics) calling given executables."""
+    ffmpeg_executable = executable or ffmpeg.FFmpeg.executable
+    ffprobe_executable = ffprobe_executable or ffprobe.FFprobe.executable
+
+    class BenchmarkFFprobe(ffprobe.FFprobe):
+        executable = ffprobe_executable
+
+    class BenchmarkEncodeStatistics(encode.EncodeStatistics):
+        ffprobe_class = BenchmarkFFprobe
+
+    class BenchmarkFFmpeg(ffmpeg.FFmpeg):
+        executable = ffmpeg_executable
+        ffprobe_class = BenchmarkFFprobe
+        statistics_class = BenchmarkEncodeStatistics
+
+    return BenchmarkFFmpeg
+
+
+def generate_input(encoder, path, duration=10, size='640x360', rate=25):
+    """Generate a media (MPEG-4 video and AAC audio) with the lavfi sources testsrc and sine."""
+    process = encoder(
+        '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', f'sine=duration={duration}',
+        '-c:v', 'mpeg4', '-q:v', '5', '-c:a', 'aac', str(path))
+    _, stderr = process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr)
+    return path
+
+
+def measure(function, repeat=1):
+    """
+    Call `function` `repeat` times and return a dictionary with the median wall time and CPU time
+    (of the calling process) in seconds.
+    """
+    wall_times, cpu_times = [], []
+    for _ in range(repeat):
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        function()
+        wall_times.append(time.perf_counter() - wall_time)
+        cpu_times.append(time.process_time() - cpu_time)
+    return {'wall_time': median(wall_times), 'cpu_time': median(cpu_times)}
+
+
+def benchmark_spawn(encoder, repeat=10):
+    """Measure the time to spawn FFmpeg and FFprobe (printing their version)."""
+    return {
+        name: measure(lambda e=executable: subprocess.run(  # pylint:disable=subprocess-run-check
+            [str(e), '-version'], stdout=subprocess.DEVNULL), repeat)
+        for name, executable in (
+            ('ffmpeg', encoder.executable),
+            ('ffprobe', encoder.ffprobe.executable))
+    }
+
+
+def benchmark_get_media_info(encoder, path, repeat=10):
+    """Measure :meth:`FFprobe.get_media_info` against FFprobe called directly."""
+    arguments = encoder.ffprobe._get_info_arguments(
+        encoder.ffprobe.to_media(str(path)),
+        ['-show_format', '-show_streams'])
+    return _compare(
+        lambda: encoder.ffprobe.get_media_info(str(path), fail=True),
+        lambda: subprocess.run(arguments, stdout=subprocess.PIPE, check=True),
+        repeat)
+
+
+def benchmark_frames_checksum(encoder, path, repeat=3):
+    """
+    Measure :meth:`FFmpeg.get_frames_md5_checksum` (first frame) and
+    :meth:`FFmpeg.get_frames_checksums` (all frames) against FFmpeg called directly.
+    """
+    arguments = [
+        str(encoder.executable), '-nostdin', '-v', 'error', '-i', str(path),
+        '-f', 'framehash', '-hash', 'md5', '-'
+    ]
+    return {
+        'first': measure(lambda: encoder.get_frames_md5_checksum(str(path)), repeat),
+        'all': _compare(
+            lambda: sum(1 for _ in encoder.get_frames_checksums(str(path), fail=True)),
+            lambda: subprocess.run(arguments, stdout=subprocess.PIPE, check=True),
+            repeat)
+    }
+
+
+def benchmark_encode(encoder, path, out_options=('-c:v', 'mpeg4', '-c:a', 'aac'), repeat=3):
+    """
+    Measure :meth:`FFmpeg.encode` against FFmpeg called directly. The CPU time of the calling
+    process is mostly spent parsing the progress of the encoding.
+
+    The memory allocated while encoding is traced (every time statistics are yielded) to detect
+    any growth over time.
+    """
+    output = Path(path).with_name('output.mkv')
+    arguments, *_ = encoder._get_arguments(str(path), str(output), None, list(out_options))
+    updates = []
+
+    def encode_with_wrapper():
+        statistics = None
+        updates.append(0)
+        for statistics in encoder.encode(str(path), str(output), out_options=list(out_options)):
+            updates[-1] += 1
+        if statistics.state != statistics.states.SUCCESS:
+            raise RuntimeError(statistics.process_output)
+
+    result = _compare(
+        encode_with_wrapper,
+        lambda: subprocess.run(arguments, stderr=subprocess.DEVNULL, check=True),
+        repeat)
+    result['wrapper']['updates'] = median(updates)
+    result['wrapper']['cpu_time_per_update'] = \
+        result['wrapper']['cpu_time'] / (median(updates) or 1)
+
+    samples = []
+    tracemalloc.start()
+    try:
+        start_time = time.perf_counter()
+        for _ in encoder.encode(str(path), str(output), out_options=list(out_options)):
+            samples.append((time.perf_counter() - start_time, tracemalloc.get_traced_memory()[0]))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    result['memory'] = {
+        'start': samples[0][1],
+        'end': samples[-1][1],
+        'growth': samples[-1][1] - samples[0][1],
+        'peak': peak,
+        'samples': samples[::max(1, len(samples) // 100)]
+    }
+    return result
+
+
+def benchmark_pool(
+    encoder,
+    path,
+    out_options=('-c:v', 'mpeg4', '-c:a', 'aac'),
+    jobs=8,
+    max_workers=None
+):
+    """Measure the throughput (jobs per second) of an :class:`EncodePool`, sequential and pooled."""
+    def encode_all(workers):
+        the_pool = pool.EncodePool(max_workers=workers, encoder=encoder)
+        submitted = [
+            the_pool.submit(str(path), str(Path(path).with_name(f'pool-{number}.mkv')),
+                            out_options=list(out_options))
+            for number in range(jobs)
+        ]
+        for _ in the_pool.run():
+            pass
+        if any(job.state != job.states.SUCCESS for job in submitted):
+            raise RuntimeError('Some encodings of the pool failed.')
+
+    max_workers = max_workers or os.cpu_count() or 1
+    result = {'jobs': jobs, 'max_workers': max_workers}
+    for name, workers in ('sequential', 1), ('pooled', max_workers):
+        timing = measure(lambda w=workers: encode_all(w))
+        result[name] = {**timing, 'throughput': jobs / timing['wall_time']}
+    return result
+
+
+def benchmark_mpd(segments=100000):
+    """Measure the parsing of a (generated) MPD with a timeline of `segments` segments."""
+    mpd = io.BytesIO()
+    mpd.write(
+        b'<?xml version="1.0"?>\n'
+        b'<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT1H0M0S">\n'
+        b'<Period><AdaptationSet contentType="video">\n'
+        b'<SegmentTemplate timescale="90000"><SegmentTimeline>\n')
+    for number in range(segments):
+        mpd.write(b'<S t="%d" d="180000"/>\n' % (number * 180000))
+    mpd.write(
+        b'</SegmentTimeline></SegmentTemplate>\n'
+        b'<Representation id="video" bandwidth="3000000" width="1280" height="720"/>\n'
+        b'</AdaptationSet></Period></MPD>\n')
+
+    def parse():
+        mpd.seek(0)
+        return miscellaneous.MPD.parse(mpd)
+
+    result = {'segments': segments, 'size': mpd.tell(), **measure(parse)}
+    tracemalloc.start()
+    try:
+        parse()
+        result['memory_peak'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def run(
+    executable=None,
+    ffprobe_executable=None,
+    duration=10,
+    size='640x360',
+    repeat=3,
+    jobs=8,
+    max_workers=None,
+    segments=100000,
+    directory=None
+):
+    """Run all the benchmarks and return the results (JSON serializable)."""
+    encoder = get_encoder_class(executable, ffprobe_executable)()
+    version = subprocess.run(
+        [str(encoder.executable), '-version'],
+        stdout=subprocess.PIPE,
+        check=True).stdout.decode('utf-8').splitlines()[0]
+    with tempfile.TemporaryDirectory(dir=directory) as temporary_directory:
+        path = generate_input(encoder, Path(temporary_directory) / 'input.mkv', duration, size)
+        return {
+            'environment': {
+                'ffmpeg': version,
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'pytoolbox': pytoolbox.__version__,
+                'cpu_count': os.cpu_count()
+            },
+            'parameters': {
+                'duration': duration,
+                'size': size,
+                'repeat': repeat
+            },
+            'benchmarks': {
+                'spawn': benchmark_spawn(encoder, repeat),
+                'get_media_info': benchmark_get_media_info(encoder, path, repeat),
+                'frames_checksum': benchmark_frames_checksum(encoder, path, repeat),
+                'encode': benchmark_encode(encoder, path, repeat=repeat),
+                'pool': benchmark_pool(encoder, path, jobs=jobs, max_workers=max_workers),
+                'mpd': benchmark_mpd(segments)
+            }
+        }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[0].strip(),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--ffmpeg', help='FFmpeg executable (default to ffmpeg)')
+    parser.add_argument('--ffprobe', help='FFprobe executable (default to ffprobe)')
+    parser.add_argument('--duration', type=int, default=10, help='Duration of the input (s)')
+    parser.add_argument('--size', default='640x360', help='Resolution of the input')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeat the measures')
+    parser.add_argument('--jobs', type=int, default=8, help='Encodings of the pool benchmark')
+    parser.add_argument('--max-workers', type=int, help='Workers of the pool benchmark')
+    parser.add_argument('--segments', type=int, default=100000, help='Segments of the MPD')
+    parser.add_argument('--output', help='Write the results to this file (default to stdout)')
+    args = parser.parse_args(args)
+    results = run(
+        executable=args.ffmpeg,
+        ffprobe_executable=args.ffprobe,
+        duration=args.duration,
+        size=args.size,
+        repeat=args.repeat,
+        jobs=args.jobs,
+        max_workers=args.max_workers,
+        segments=args.segments)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+def _compare(wrapper, direct, repeat):
+    """Measure a `wrapper` and the `direct` call to the executable, return the results."""
+    wrapper, direct = measure(wrapper, repeat), measure(direct, repeat)
+    return {
+        'wrapper': wrapper,
+        'direct': direct,
+        'overhead': wrapper['wall_time'] - direct['wall_time']
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,15 @@
-import datetime, re, time
+import collections, datetime, re, time
 
 from pytoolbox.datetime import datetime_now, multiply_time, secs_to_time, str_to_time, time_ratio
 from . import ffprobe, utils
 
-__all__ = ['ENCODING_REGEX', 'EncodeState', 'EncodeStatistics', 'FrameBasedRatioMixin']
+__all__ = [
+    'ENCODING_REGEX',
+    'EncodeState',
+    'EncodeStatistics',
+    'FrameBasedRatioMixin',
+    'ProgressParser'
+]
 
 ENCODING_REGEX = re.compile(
     # frame= 2071 fps=  0 q=-1.0 size=   34623kB time=00:01:25.89 bitrate=3302.3kbits/s
@@ -27,24 +33,93 @@ class EncodeState(object):  # pylint:disable=too-few-public-methods
     FINAL_STATES = frozenset([SUCCESS, FAILURE])
 
 
+class ProgressParser(object):  # pylint:disable=too-few-public-methods
+    """
+    Incremental parser of the machine-readable progress FFmpeg writes when called with `-progress`.
+
+    **Example usage**
+
+    >>> parser = ProgressParser()
+    >>> parser.feed(b'frame=10\\nfps=0.00\\nout_time_us=33')
+    []
+    >>> parser.feed(b'3333\\nprogress=continue\\nframe=')
+    [{'frame': '10', 'fps': '0.00', 'out_time_us': '333333', 'progress': 'continue'}]
+    >>> parser.feed(b'20\\nprogress=end\\n')
+    [{'frame': '20', 'progress': 'end'}]
+    >>> parser.feed(b'frame=30\\r\\nprogress = end\\r\\n')
+    [{'frame': '30', 'progress': 'end'}]
+    """
+
+    def __init__(self):
+        self._buffer = b''
+        self._report = {}
+
+    def feed(self, data):
+        """Parse `data` and return the list of reports completed by those data (usually one)."""
+        *lines, self._buffer = (self._buffer + data).split(b'\n')
+        reports = []
+        for line in lines:
+            key, separator, value = line.decode('utf-8', 'replace').partition('=')
+            if separator:
+                key = key.strip()
+                self._report[key] = value.strip()
+                if key == 'progress':
+                    reports.append(self._report)
+                    self._report = {}
+        return reports
+
+
 class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
+    """
+    Statistics about an encoding process, updated by its output.
+
+    The input is probed once (a single FFprobe process retrieving `input_entries`), set
+    `media_info` to the output of :meth:`FFprobe.get_media_info` to skip it. The output is not
+    probed if FFmpeg reported its progress (see :class:`ProgressParser`), its duration and size are
+    taken from the last report.
+
+    Only the last `process_output_limit` characters of the output are kept in memory. Set
+    `process_output_path` to a filename to store the whole output in a file, closed by
+    :meth:`end` or :meth:`close`.
+    """
 
     default_in_duration = datetime.timedelta(seconds=0)
     encoding_regex = ENCODING_REGEX
     ffprobe_class = ffprobe.FFprobe
+    input_entries = {'format': ['duration'], 'stream': ['avg_frame_rate']}
+    line_regex = re.compile(r'[\r\n]')
+    process_output_limit = 64 * 1024
     states = EncodeState
 
-    def __init__(self, inputs, outputs, in_options, out_options, in_base_index=0, out_base_index=0):
+    def __init__(
+        self,
+        inputs,
+        outputs,
+        in_options,
+        out_options,
+        in_base_index=0,
+        out_base_index=0,
+        process_output_limit=None,
+        process_output_path=None,
+        media_info=None
+    ):
         self.inputs = inputs
         self.outputs = outputs
         self.in_options = in_options
         self.out_options = out_options
         self.in_base_index = in_base_index
         self.out_base_index = out_base_index
+        self.process_output_limit = process_output_limit or self.process_output_limit
+        self.process_output_path = process_output_path
 
+        self.ffprobe = self.ffprobe_class()
         self.process = None
-        self.process_output = ''
+        self.report = None
         self.returncode = None
+        self._output_chunks = collections.deque()
+        self._output_file = None
+        self._output_line = ''
+        self._output_size = 0
 
         self.state = self.states.NEW
         self.start_date = None
@@ -57,7 +132,9 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
         self.bit_rate = None
 
         # Retrieve input media duration and size, handle sub-clipping
-        duration = self.ffprobe_class().get_media_duration(self.input, as_delta=True)
+        self.input_info = media_info if media_info is not None else \
+            self.ffprobe.get_media_entries(self.input, self.input_entries)
+        duration = self.ffprobe.get_media_duration(self.input_info or {}, as_delta=True)
         duration = duration or self.default_in_duration
         self.input.duration, self.input.size = \
             self._get_subclip_duration_and_size(duration, self.input.size, self.out_options)
@@ -75,6 +152,11 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
     def input(self):
         return self.inputs[self.in_base_index]
 
+    @property
+    def process_output(self):
+        """The tail of the output of the process (up to `process_output_limit` characters)."""
+        return ''.join(self._output_chunks)[-self.process_output_limit:]
+
     @property
     def output(self):
         return self.outputs[self.out_base_index]
@@ -94,10 +176,19 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
         self._update_ratio()
         return self
 
-    def progress(self, chunk):
+    def progress(self, chunk, report=None):
+        """
+        Update statistics with a `chunk` of FFmpeg's output and optionally a `report` parsed from
+        its ``-progress`` output (see :class:`ProgressParser`). The chunk is parsed only if no
+        report is given.
+        """
         self.state = self.states.PROCESSING
         self.elapsed_time = datetime.timedelta(seconds=time.time() - self.start_time)
-        if ffmpeg_statistics := self._parse_chunk(chunk):
+        self._append_output(chunk)
+        ffmpeg_statistics = self._parse_report(report) if report else self._parse_lines(chunk)
+        if ffmpeg_statistics:
+            if report:
+                self.report = report
             self.output.duration = ffmpeg_statistics['time']
             self.frame = ffmpeg_statistics['frame']
             self.frame_rate = ffmpeg_statistics['frame_rate']
@@ -112,12 +203,33 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
         self.returncode = returncode
         self.elapsed_time = datetime.timedelta(seconds=time.time() - self.start_time)
         self.frame_rate = self.frame / (self.elapsed_time.total_seconds() or 0.0001)
-        self.output.duration = self.ffprobe_class().get_media_duration(
-            self.output.path, as_delta=True)
-        self.output.size = None
+        if self.report is None:
+            self.output.duration = self.ffprobe.get_media_duration(self.output.path, as_delta=True)
+            self.output.size = None
         self._update_ratio()
+        self.close()
         return self
 
+    def close(self):
+        """Close the file storing the output of the process (if any)."""
+        if self._output_file:
+            self._output_file.close()
+            self._output_file = None
+
+    def _append_output(self, chunk):
+        """Append `chunk` to the output, drop the oldest chunks exceeding the limit."""
+        if not chunk:
+            return
+        if self.process_output_path:
+            if self._output_file is None:
+                self._output_file = open(  # pylint:disable=consider-using-with
+                    self.process_output_path, 'w', encoding='utf-8')
+            self._output_file.write(chunk)
+        self._output_chunks.append(chunk)
+        self._output_size += len(chunk)
+        while self._output_size - len(self._output_chunks[0]) >= self.process_output_limit:
+            self._output_size -= len(self._output_chunks.popleft())
+
     def _update_ratio(self):
         if self.state == self.states.SUCCESS:
             self.ratio = 1.0
@@ -150,8 +262,19 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
         sub_duration = max(zero, min(duration - sub_position, sub_duration))
         return sub_duration, int(size * time_ratio(sub_duration, duration))
 
+    def _parse_lines(self, chunk):
+        """
+        Return the statistics from the last complete line of output parsable as statistics or
+        None. The last line of `chunk` is kept to be completed by the next chunk.
+        """
+        *lines, line = self.line_regex.split(self._output_line + chunk)
+        self._output_line = line[-self.process_output_limit:]
+        for line in reversed(lines):
+            if ffmpeg_statistics := self._parse_chunk(line):
+                return ffmpeg_statistics
+        return None
+
     def _parse_chunk(self, chunk):
-        self.process_output += chunk
         if not (match := self.encoding_regex.match(chunk.strip())):
             return None
         ffmpeg_statistics = match.groupdict()
@@ -167,6 +290,28 @@ class EncodeStatistics(object):  # pylint:disable=too-many-instance-attributes
         ffmpeg_statistics['bit_rate'] = utils.to_bit_rate(ffmpeg_statistics['bit_rate'])
         return ffmpeg_statistics
 
+    @staticmethod
+    def _parse_report(report):
+        """Return the statistics from a `report` of FFmpeg's ``-progress`` output or None."""
+
+        def to_number(key, kind, default=None):
+            value = report.get(key, 'N/A')
+            return default if value == 'N/A' else kind(value)
+
+        try:
+            if (out_time := report.get('out_time_us', report.get('out_time_ms', 'N/A'))) == 'N/A':
+                return None
+            return {
+                'time': datetime.timedelta(microseconds=max(0, int(out_time))),
+                'frame': to_number('frame', int, 0),
+                'frame_rate': to_number('fps', float, 0.0),
+                'qscale': next((float(v) for k, v in report.items() if k.endswith('_q')), None),
+                'size': to_number('total_size', int),
+                'bit_rate': utils.to_bit_rate(report.get('bitrate', 'N/A'))
+            }
+        except ValueError:
+            return None  # Parsed statistics are broken, do not use them
+
     @staticmethod
     def _to_time(value):
         method = str_to_time if ':' in value else secs_to_time
@@ -182,7 +327,7 @@ class FrameBasedRatioMixin(object):  # pylint:disable=too-few-public-methods
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        fps = self.ffprobe_class().get_video_frame_rate(self.input)
+        fps = self.ffprobe.get_video_frame_rate(self.input_info or {})
         if fps and self.input.duration:
             self.input.frame = fps * self.input.duration.total_seconds()
         else:
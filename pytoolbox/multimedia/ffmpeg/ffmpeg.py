@@ -1,13 +1,24 @@
-import errno, itertools, re, select, subprocess, sys, time
+import codecs, collections, datetime, itertools, os, re, selectors, subprocess, sys, warnings
 from pathlib import Path
 
 from pytoolbox import filesystem, subprocess as py_subprocess
-from . import encode, ffprobe  # pylint:disable=unused-import
+from . import encode, ffprobe
 
-__all__ = ['FRAME_MD5_REGEX', 'FFmpeg']
+__all__ = ['FRAME_MD5_REGEX', 'FFmpeg', 'FrameChecksum', 'Rendition']
 
 FRAME_MD5_REGEX = re.compile(r'[a-z0-9]{32}', re.MULTILINE)
 
+FrameChecksum = collections.namedtuple(
+    'FrameChecksum',
+    ['stream', 'dts', 'pts', 'duration', 'size', 'hash'])
+
+# A rendition of FFmpeg.encode_renditions, set width or height to scale the video (keeping the
+# aspect ratio if only one is set) and options to the options specific to this output
+Rendition = collections.namedtuple(
+    'Rendition',
+    ['output', 'width', 'height', 'options'],
+    defaults=(None, None, None))
+
 
 class FFmpeg(object):
     """
@@ -19,17 +30,27 @@ class FFmpeg(object):
     ffprobe_class = ffprobe.FFprobe
     statistics_class = encode.EncodeStatistics
 
+    #: Output options (taking a value) of the muxer, kept when remuxing an output
+    muxer_options = frozenset(['-brand', '-f', '-fflags', '-metadata', '-movflags'])
+
     def __init__(
         self,
         executable=None,
         chunk_read_timeout=0.5,
-        encode_poll_delay=0.5,
-        encoding='utf-8'
+        encode_poll_delay=None,
+        encoding='utf-8',
+        progress_period=None
     ):
+        if encode_poll_delay is not None:
+            warnings.warn(
+                'Argument encode_poll_delay is deprecated and ignored, the progress is read from '
+                'a pipe.',
+                category=DeprecationWarning,
+                stacklevel=2)
         self.executable = executable or self.executable
         self.chunk_read_timeout = chunk_read_timeout
-        self.encode_poll_delay = encode_poll_delay
         self.encoding = encoding
+        self.progress_period = progress_period
         self.ffprobe = self.ffprobe_class()
 
     def __call__(self, *arguments):
@@ -46,54 +67,335 @@ class FFmpeg(object):
         in_options=None,
         out_options=None,
         create_directories=True,
-        process_poll=True,
+        process_poll=None,
         process_kwargs=None,
         statistics_kwargs=None
     ):
         """
         Encode a set of input files input to a set of output files and yields statistics about the
         encoding.
-        """
-        arguments, inputs, outputs, in_options, out_options = \
-            self._get_arguments(inputs, outputs, in_options, out_options)
 
-        # Create outputs directories
-        if create_directories:
-            for output in outputs:
-                output.create_directory()
+        Statistics are updated from the machine-readable report FFmpeg writes to a dedicated pipe
+        (``-progress``). Both this pipe and stderr are watched by a selector so any update is
+        yielded as soon as it is available. If nothing happens for `chunk_read_timeout` seconds then
+        the statistics are yielded anyway (to refresh elapsed and estimated time).
 
-        statistics = self.statistics_class(
+        Set `progress_period` (constructor) to make FFmpeg report more (or less) frequently than
+        every 0.5 seconds (requires FFmpeg >= 4.4).
+
+        The argument `process_poll` is deprecated and ignored.
+        """
+        if process_poll is not None:
+            warnings.warn(
+                'Argument process_poll is deprecated and ignored, the progress is read from a '
+                'pipe.',
+                category=DeprecationWarning,
+                stacklevel=2)
+        process, statistics = self._create_encode(
             inputs,
             outputs,
             in_options,
             out_options,
-            **(statistics_kwargs or {}))
-
-        process = self._get_process(arguments, **(process_kwargs or {}))
+            create_directories,
+            process_kwargs,
+            statistics_kwargs)
         try:
             yield statistics.start(process)
-            while True:
-                chunk = self._get_chunk(process)
-                yield statistics.progress(chunk or '')
-                if process_poll:
-                    if (returncode := process.poll()) is not None:
-                        break
-                if self.encode_poll_delay:
-                    time.sleep(self.encode_poll_delay)
-            yield statistics.end(returncode)
+            with selectors.DefaultSelector() as selector:
+                self._register_process(selector, process, statistics)
+                while selector.get_map():
+                    yield from self._select(selector)
         except Exception as ex:
             traceback = sys.exc_info()[2]
             py_subprocess.kill(process)
             raise ex.with_traceback(traceback) if hasattr(ex, 'with_traceback') else ex
+        finally:
+            if process.poll() is None:
+                py_subprocess.kill(process)  # Generator closed before the end of the encoding
+            process.progress.close()
+            process.stderr.close()
+            statistics.close()
 
-    @staticmethod
-    def get_frames_md5_checksum(filename):
-        with filesystem.TempStorage() as tmp:
-            checksum_filename = tmp.create_tmp_file(return_file=False)
-            FFmpeg()('-y', '-i', filename, '-f', 'framemd5', checksum_filename).wait()
-            with open(checksum_filename, encoding='utf-8') as f:
-                match = FRAME_MD5_REGEX.search(f.read())
-            return match.group() if match else None
+    def encode_renditions(
+        self,
+        the_input,
+        renditions,
+        in_options=None,
+        out_options=None,
+        create_directories=True,
+        process_kwargs=None,
+        statistics_kwargs=None
+    ):
+        """
+        Encode `the_input` to multiple `renditions` (instances of :class:`Rendition`) with a single
+        process: the first video stream is decoded once then split and scaled for every rendition
+        by a filter graph. The first audio stream (if any) is encoded for every rendition.
+
+        Options of every rendition are appended to `out_options` (applied to all the renditions).
+
+        Yields a list with the statistics of every rendition, see :meth:`encode`. The progress is
+        reported by FFmpeg for the whole process: while processing, only the quality (`qscale`) is
+        specific to every rendition, the time, ratio, frame, size and bit rate are those of the
+        report (FFmpeg reports the frames and size of the first output). Once the encoding is
+        ended, the size and bit rate are retrieved from the output file of every rendition. The
+        output of the process is only kept by the statistics of the first rendition.
+        """
+        out_options = py_subprocess.to_args_list(out_options)
+        outputs = []
+        for number, rendition in enumerate(renditions):
+            output = self.ffprobe.to_media(rendition.output)
+            outputs.append(self.ffprobe.media_class(output.path, [
+                '-map', f'[out{number}]', '-map', '0:a:0?',
+                *out_options,
+                *py_subprocess.to_args_list(rendition.options),
+                *output.options
+            ]))
+
+        statistics = []
+        for main in self.encode(
+            the_input,
+            outputs,
+            in_options,
+            ['-filter_complex', self._get_renditions_filter(renditions)],
+            create_directories=create_directories,
+            process_kwargs=process_kwargs,
+            statistics_kwargs=statistics_kwargs
+        ):
+            if not statistics:
+                statistics = [main] + [
+                    self.statistics_class(
+                        main.inputs,
+                        outputs,
+                        main.in_options,
+                        main.out_options,
+                        out_base_index=number,
+                        media_info=main.input_info,
+                        **(statistics_kwargs or {})).start(main.process)
+                    for number in range(1, len(outputs))
+                ]
+            for number, rendition in enumerate(statistics[1:], 1):
+                if main.state in main.states.FINAL_STATES:
+                    rendition.end(main.returncode)
+                elif main.state == main.states.PROCESSING:
+                    rendition.progress('', main.report)
+                    # Quality of the video stream of the rendition (the first stream of its output)
+                    if (qscale := (main.report or {}).get(f'stream_{number}_0_q')) is not None:
+                        rendition.qscale = float(qscale)
+            if main.state in main.states.FINAL_STATES:
+                for rendition in statistics:
+                    rendition.output.size = None  # Size of the output file
+                    seconds = (rendition.output.duration or datetime.timedelta(0)).total_seconds()
+                    rendition.bit_rate = \
+                        int(8 * rendition.output.size / seconds) if seconds else None
+            yield statistics
+
+    def encode_segmented(  # pylint:disable=too-many-locals,too-many-statements
+        self,
+        the_input,
+        output,
+        in_options=None,
+        out_options=None,
+        segments=None,
+        max_workers=None,
+        create_directories=True,
+        statistics_kwargs=None
+    ):
+        """
+        Encode `the_input` to `output` by splitting the video at keyframes into `segments` encoded
+        concurrently, then concatenated (concat demuxer, no re-encoding). Yields statistics about
+        the whole encoding, merged from the statistics of the segments.
+
+        * Set `max_workers` to limit the number of concurrent processes (default to the number of
+          CPUs), `segments` defaults to `max_workers`.
+        * The audio is encoded separately (one more process) to avoid glitches at the boundaries of
+          the segments. Other streams are discarded.
+        * Options of `output` and `out_options` are applied to every segment, the final output is
+          muxed with the codecs copied and only their muxer options (see :attr:`muxer_options`).
+          Sub-clipping (``-ss``, ``-t``) is not supported.
+
+        The input is probed (media info and keyframes of the first video stream) by the calling
+        process. Falls back to :meth:`encode` if the input has no video stream or no duration.
+        """
+        the_input = self.ffprobe.to_media(the_input)
+        output = self.ffprobe.to_media(output)
+        in_options = py_subprocess.to_args_list(in_options)
+        out_options = py_subprocess.to_args_list(out_options)
+        max_workers = max_workers or os.cpu_count() or 1
+        media_info = self.ffprobe.get_media_info(the_input)
+        statistics = self.statistics_class(
+            [the_input],
+            [output],
+            in_options,
+            out_options,
+            media_info=media_info,
+            **(statistics_kwargs or {}))
+        streams = (media_info or {}).get('streams', [])
+        index = None
+        if statistics.input.duration and any(s.get('codec_type') == 'video' for s in streams):
+            index = self.ffprobe.get_packet_index(the_input)
+        if not index:
+            yield from self.encode(
+                the_input,
+                output,
+                in_options,
+                out_options,
+                create_directories=create_directories,
+                statistics_kwargs=statistics_kwargs)
+            return
+
+        if create_directories:
+            output.create_directory()
+        duration = statistics.input.duration.total_seconds()
+        # The keyframes are timestamped from the start of the container, -ss is relative to it
+        start_time = float(media_info['format'].get('start_time') or 0)
+        keyframes = [t - start_time for t in index.keyframes_times]
+        has_audio = any(s.get('codec_type') == 'audio' for s in streams)
+        extension = Path(str(output.path)).suffix
+
+        with filesystem.TempStorage(root=output.directory) as storage:
+            directory = Path(storage.create_tmp_directory())
+            jobs = []
+            for number, (start, length) in enumerate(
+                self._get_segments(keyframes, duration, segments or max_workers)
+            ):
+                options = ['-ss', repr(start)] + ([] if length is None else ['-t', repr(length)])
+                segment = self.ffprobe.media_class(
+                    directory / f'segment-{number:05d}{extension}',
+                    output.options + ['-an', '-sn', '-dn'])
+                length = (duration - start) if length is None else length
+                jobs.append((
+                    True,
+                    self.ffprobe.media_class(the_input.path, the_input.options + options),
+                    segment,
+                    {**media_info, 'format': {**media_info['format'], 'duration': str(length)}}))
+            if has_audio:
+                jobs.append((
+                    False,
+                    the_input,
+                    self.ffprobe.media_class(
+                        directory / f'audio{extension}', output.options + ['-vn', '-sn', '-dn']),
+                    media_info))
+
+            children, processes, segments_statistics = [], [], []
+            yield statistics.start(None)
+            try:
+                with selectors.DefaultSelector() as selector:
+                    while jobs or selector.get_map():
+                        while jobs and sum(
+                            c.state not in c.states.FINAL_STATES for c in children
+                        ) < max_workers:
+                            is_segment, child_input, child_output, child_info = jobs.pop(0)
+                            arguments, *_ = self._get_arguments(
+                                child_input, child_output, in_options, out_options)
+                            child = self.statistics_class(
+                                [child_input],
+                                [child_output],
+                                in_options,
+                                out_options,
+                                media_info=child_info)
+                            process = self._get_process(arguments, progress=True)
+                            processes.append(process)
+                            children.append(child.start(process))
+                            if is_segment:
+                                segments_statistics.append(child)
+                            self._register_process(selector, process, child)
+                        if updated := set(self._select(selector)):
+                            for child in updated:
+                                if child.state == child.states.FAILURE:
+                                    statistics.progress(child.process_output)
+                                    yield statistics.end(child.returncode)
+                                    return
+                            yield self._merge_statistics(statistics, children, segments_statistics)
+
+                list_path = directory / 'segments.txt'
+                with open(list_path, 'w', encoding='utf-8') as f:
+                    for child in segments_statistics:
+                        path = str(child.output.path).replace("'", "'\\''")
+                        f.write(f"file '{path}'\n")
+                arguments = [
+                    self.executable, '-y', '-v', 'error',
+                    '-f', 'concat', '-safe', '0', '-i', str(list_path)
+                ]
+                if has_audio:
+                    audio, = (c for c in children if c not in segments_statistics)
+                    arguments += ['-i', str(audio.output.path), '-map', '0:v', '-map', '1:a']
+                arguments += [
+                    '-c', 'copy',
+                    *self._get_muxer_options(out_options + output.options),
+                    str(output.path)
+                ]
+                result = py_subprocess.cmd(arguments, fail=False)
+                statistics.progress((result['stderr'] or b'').decode(self.encoding, 'replace'))
+                output.size = None  # The real size of the output
+                yield statistics.end(result['returncode'])
+            finally:
+                for process in processes:
+                    if process.poll() is None:
+                        py_subprocess.kill(process)
+                        process.wait()
+                    process.progress.close()
+                    process.stderr.close()
+                statistics.close()
+
+    @classmethod
+    def get_frames_md5_checksum(cls, filename):
+        """Return the MD5 checksum of the first frame of `filename` or None in case of error."""
+        checksums = cls().get_frames_checksums(filename)
+        try:
+            return next(checksums).hash
+        except StopIteration:
+            return None
+        finally:
+            checksums.close()
+
+    def get_frames_checksums(
+        self,
+        media,
+        algorithm='md5',
+        streams=None,
+        start=None,
+        duration=None,
+        fail=False
+    ):
+        """
+        Yield an instance of :class:`FrameChecksum` for every (decoded) frame of `media`.
+
+        The output of the *framehash* muxer is streamed through a pipe and parsed as it comes, the
+        process is killed if the generator is closed before the end.
+
+        * Set `algorithm` to any hash supported by the muxer (e.g. md5, sha256, crc32).
+        * Set `streams` to a list of stream specifiers (e.g. ``['v:0']``) to select the streams.
+        * Set `start` and/or `duration` (seconds or a time string) to checksum a time range.
+        * Set `fail` to True to raise :class:`subprocess.CalledProcessError` if FFmpeg fails.
+        """
+        media = self.ffprobe.to_media(media)
+        arguments = [self.executable, '-nostdin', '-v', 'error']
+        if start is not None:
+            arguments += ['-ss', str(start)]
+        if duration is not None:
+            arguments += ['-t', str(duration)]
+        arguments += media.to_args(is_input=True)
+        for stream in streams or []:
+            arguments += ['-map', f'0:{stream}']
+        arguments += ['-f', 'framehash', '-hash', algorithm, '-']
+        process = py_subprocess.raw_cmd(
+            arguments,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            close_fds=True)
+        try:
+            for line in process.stdout:
+                if line[:1] != b'#' and len(fields := line.split(b',')) == 6:
+                    *numbers, the_hash = fields
+                    the_hash = the_hash.strip().decode('ascii')
+                    yield FrameChecksum(*(int(n) for n in numbers), the_hash)
+            if process.wait() and fail:
+                raise subprocess.CalledProcessError(process.returncode, arguments)
+        finally:
+            if process.poll() is None:
+                py_subprocess.kill(process)
+                process.wait()
+            process.stdout.close()
 
     def _clean_medias_argument(self, value):
         """
@@ -103,6 +405,39 @@ class FFmpeg(object):
         values = [value] if isinstance(value, (str, Path, self.ffprobe.media_class)) else value
         return [self.ffprobe.to_media(v) for v in values] if values else []
 
+    def _create_encode(
+        self,
+        inputs,
+        outputs,
+        in_options=None,
+        out_options=None,
+        create_directories=True,
+        process_kwargs=None,
+        statistics_kwargs=None
+    ):
+        """
+        Return the process and the (not yet started) statistics of an encoding, see :meth:`encode`.
+        """
+        arguments, inputs, outputs, in_options, out_options = \
+            self._get_arguments(inputs, outputs, in_options, out_options)
+
+        # Create outputs directories
+        if create_directories:
+            for output in outputs:
+                output.create_directory()
+
+        statistics = self.statistics_class(
+            inputs,
+            outputs,
+            in_options,
+            out_options,
+            **(statistics_kwargs or {}))
+
+        if self.progress_period:
+            arguments[1:1] = ['-stats_period', str(self.progress_period)]
+        process = self._get_process(arguments, progress=True, **(process_kwargs or {}))
+        return process, statistics
+
     def _get_arguments(self, inputs, outputs, in_options=None, out_options=None):
         """
         Return the arguments for the encoding process.
@@ -128,25 +463,180 @@ class FFmpeg(object):
             args.extend(output.to_args(is_input=False))
         return args, inputs, outputs, in_options, out_options
 
-    def _get_chunk(self, process):
-        select.select([process.stderr], [], [], self.chunk_read_timeout)
-        try:
-            chunk = process.stderr.read()
-            if chunk is None or isinstance(chunk, str):
-                return chunk
-            return chunk.decode(self.encoding)
-        except IOError as ex:
-            if ex.errno != errno.EAGAIN:
-                raise
-        return None
+    def _get_muxer_options(self, options):
+        """
+        Return the muxer options (and their value) of `options`, see :attr:`muxer_options`.
+
+        **Example usage**
+
+        >>> FFmpeg()._get_muxer_options([
+        ...     '-c:v', 'libx264', '-movflags', '+faststart', '-metadata:s:v', 'title=Video', '-an'
+        ... ])
+        ['-movflags', '+faststart', '-metadata:s:v', 'title=Video']
+        """
+        return [
+            argument
+            for option, value in zip(options, options[1:])
+            if str(option).split(':', 1)[0] in self.muxer_options
+            for argument in (option, value)
+        ]
 
     @staticmethod
-    def _get_process(arguments, **process_kwargs):
-        """Return an encoding process with stderr made asynchronous."""
-        process = py_subprocess.raw_cmd(
-            arguments,
-            stderr=subprocess.PIPE,
-            close_fds=True,
-            **process_kwargs)
+    def _get_renditions_filter(renditions):
+        """
+        Return a filter graph splitting the first video stream then scaling it for every rendition.
+
+        **Example usage**
+
+        >>> FFmpeg._get_renditions_filter([
+        ...     Rendition('a.mp4', 1280, 720),
+        ...     Rendition('b.mp4'),
+        ...     Rendition('c.mp4', height=360)
+        ... ])
+        '[0:v:0]split=3[v0][v1][v2];[v0]scale=1280:720[out0];[v1]null[out1];[v2]scale=-2:360[out2]'
+        """
+        graph = [f'[0:v:0]split={len(renditions)}' + ''.join(
+            f'[v{n}]' for n in range(len(renditions)))]
+        for number, rendition in enumerate(renditions):
+            if rendition.width is None and rendition.height is None:
+                graph.append(f'[v{number}]null[out{number}]')
+            else:
+                width, height = rendition.width or -2, rendition.height or -2
+                graph.append(f'[v{number}]scale={width}:{height}[out{number}]')
+        return ';'.join(graph)
+
+    @staticmethod
+    def _get_segments(keyframes, duration, count):
+        """
+        Return a list with the (start, duration) in seconds of up to `count` segments of
+        approximately the same `duration` starting at `keyframes` (times in seconds relative to the
+        start of the media). The first segment starts at the first keyframe, the duration of the
+        last segment is None (up to the end).
+
+        **Example usage**
+
+        >>> FFmpeg._get_segments([0.0, 1.0, 2.0, 3.0, 4.0, 5.0], 6.0, 3)
+        [(0.0, 2.0), (2.0, 2.0), (4.0, None)]
+        >>> FFmpeg._get_segments([0.0, 4.5], 6.0, 3)
+        [(0.0, 4.5), (4.5, None)]
+        >>> FFmpeg._get_segments([0.5, 2.5, 4.5], 6.0, 3)
+        [(0.5, 2.0), (2.5, 2.0), (4.5, None)]
+        >>> FFmpeg._get_segments([], 6.0, 3)
+        [(0.0, None)]
+        """
+        keyframes = sorted(keyframes)
+        starts = keyframes[:1] or [0.0]
+        for number in range(1, count):
+            target = duration * number / count
+            start = next((k for k in keyframes if k >= target), None)
+            if start is not None and start > starts[-1]:
+                starts.append(start)
+        return [(s, None if e is None else e - s) for s, e in zip(starts, starts[1:] + [None])]
+
+    @staticmethod
+    def _merge_statistics(statistics, children, segments):
+        """
+        Update `statistics` with the progress of the `children` processes (`segments` are the
+        children encoding the video) and return it.
+        """
+        zero = datetime.timedelta(0)
+        duration = sum((s.output.duration or zero for s in segments), zero)
+        return statistics.progress('', {
+            'frame': sum(s.frame or 0 for s in segments),
+            'fps': sum(s.frame_rate or 0 for s in segments if s.state == s.states.PROCESSING),
+            'total_size': sum(c.output.size or 0 for c in children),
+            'out_time_us': duration // datetime.timedelta(microseconds=1),
+            'progress': 'continue'
+        })
+
+    @staticmethod
+    def _get_process(arguments, progress=False, **process_kwargs):
+        """
+        Return an encoding process with stderr made asynchronous.
+
+        Set `progress` to True to make FFmpeg report its progress to a dedicated pipe, available as
+        the ``progress`` attribute of the process (a binary file object).
+        """
+        read_fd = write_fd = None
+        if progress:
+            read_fd, write_fd = os.pipe()
+            executable, *arguments = py_subprocess.to_args_list(arguments)
+            arguments = [executable, '-nostats', '-progress', f'pipe:{write_fd}', *arguments]
+            process_kwargs['pass_fds'] = (*process_kwargs.get('pass_fds', ()), write_fd)
+        try:
+            process = py_subprocess.raw_cmd(
+                arguments,
+                stderr=subprocess.PIPE,
+                close_fds=True,
+                **process_kwargs)
+        except Exception:
+            if read_fd is not None:
+                os.close(read_fd)
+            raise
+        finally:
+            if write_fd is not None:
+                os.close(write_fd)
         py_subprocess.make_async(process.stderr)
+        if progress:
+            process.progress = os.fdopen(read_fd, 'rb', buffering=0)
         return process
+
+    def _register_process(self, selector, process, statistics):
+        """Register the progress and stderr pipes of an encoding `process` to `selector`."""
+        pipes = _ProcessPipes(process, statistics, self.encoding)
+        selector.register(process.progress, selectors.EVENT_READ, pipes)
+        selector.register(process.stderr, selectors.EVENT_READ, pipes)
+        return pipes
+
+    def _select(self, selector):
+        """
+        Wait for any of the pipes registered to `selector` to be ready then yield the statistics
+        updated by the reports.
+
+        The statistics of a process are ended (and the process unregistered) once both of its pipes
+        are closed.
+        """
+        updated = {}
+        events = selector.select(self.chunk_read_timeout)
+        for key, _ in events:
+            pipes = key.data
+            if data := os.read(key.fd, 65536):
+                if key.fileobj is pipes.process.progress:
+                    if reports := pipes.parser.feed(data):
+                        pipes.reports.extend(reports)
+                        updated[id(pipes)] = pipes
+                else:
+                    # Output is buffered until the next report, no need to wake up the consumer
+                    pipes.chunk += pipes.decoder.decode(data)
+            else:
+                selector.unregister(key.fileobj)
+                pipes.opened -= 1
+                updated[id(pipes)] = pipes
+        if not events:
+            updated = {id(k.data): k.data for k in selector.get_map().values()}
+        for pipes in updated.values():
+            yield from pipes.progress()
+            if not pipes.opened:
+                yield pipes.statistics.end(pipes.process.wait())
+
+
+class _ProcessPipes(object):  # pylint:disable=too-few-public-methods
+    """State of the pipes of an encoding process registered to a selector."""
+
+    def __init__(self, process, statistics, encoding):
+        self.process = process
+        self.statistics = statistics
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.parser = encode.ProgressParser()
+        self.opened = 2
+        self.chunk = ''
+        self.reports = []
+
+    def progress(self):
+        """Yield the statistics updated with the data read so far from the pipes."""
+        chunk, reports, self.chunk, self.reports = self.chunk, self.reports, '', []
+        for report in reports:
+            yield self.statistics.progress(chunk, report)
+            chunk = ''
+        if chunk or not reports:
+            yield self.statistics.progress(chunk)
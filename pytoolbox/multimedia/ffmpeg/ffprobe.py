@@ -1,8 +1,7 @@
-import datetime, errno, itertools, json, math, os, re, subprocess
+import asyncio, concurrent.futures, datetime, errno, fractions, itertools, json, math, os, re
+import subprocess
 from pathlib import Path
 
-from xml.dom import minidom
-
 from pytoolbox import subprocess as py_subprocess
 from pytoolbox.datetime import parts_to_time, secs_to_time
 from . import miscellaneous, utils
@@ -16,12 +15,22 @@ class FFprobe(object):
 
     executable = 'ffprobe'
     duration_regex = DURATION_REGEX
+    entries_classes = {
+        'format': miscellaneous.Format,
+        'audio': miscellaneous.AudioStream,
+        'subtitle': miscellaneous.SubtitleStream,
+        'video': miscellaneous.VideoStream
+    }
     format_class = None
     media_class = miscellaneous.Media
+    mpd_class = miscellaneous.MPD
+    packet_index_class = miscellaneous.PacketIndex
+    probe_size = 512 * 1024
     stream_classes = {'audio': None, 'subtitle': None, 'video': None}
 
-    def __init__(self, executable=None):
+    def __init__(self, executable=None, probe_size=None):
         self.executable = executable or self.executable
+        self.probe_size = probe_size or self.probe_size
 
     def __call__(self, *arguments):
         """Call FFprobe with given arguments and return the output (unicode string)."""
@@ -44,18 +53,17 @@ class FFprobe(object):
         *mediaPresentationDuration*.
         """
         if isinstance(media, (str, Path)) and os.path.splitext(media)[1] == '.mpd':
-            with open(media, encoding='utf-8') as f:
-                mpd = minidom.parse(f)
-            if mpd.firstChild.nodeName == 'MPD':
+            mpd = self.get_mpd(media, representations=False, fail=fail)
+            if mpd is not None:
                 match = self.duration_regex.search(
-                    mpd.firstChild.getAttribute('mediaPresentationDuration'))
+                    mpd.attributes.get('mediaPresentationDuration', ''))
                 if match is not None:
                     hours, minutes = int(match.group('hours')), int(match.group('minutes'))
                     microseconds, seconds = math.modf(float(match.group('seconds')))
                     microseconds, seconds = int(1000000 * microseconds), int(seconds)
                     return parts_to_time(hours, minutes, seconds, microseconds, as_delta=as_delta)
         else:
-            info = self.get_media_info(media, fail)
+            info = self.get_media_entries(media, {'format': ['duration']}, fail=fail)
             duration = None
             if info:
                 try:
@@ -68,30 +76,18 @@ class FFprobe(object):
                 return duration
         return None
 
-    def get_media_info(self, media, fail=False):
+    def get_mpd(self, media, representations=True, fail=False):
         """
-        Return a Python dictionary containing information about the media or None in case of error.
-        Set `media` to an instance of `self.media_class` or a path.
-        If `media` is a Python dictionary, then it is returned.
+        Return an instance of `self.mpd_class` with the attributes and the representations of a
+        MPEG-DASH MPD or None in case of error.
+        Set `media` to a path or a binary file object.
+
+        The MPD is parsed incrementally (see :class:`MPD`), set `representations` to False to only
+        parse the attributes of the root element.
         """
-        if isinstance(media, dict):
-            return media
-        media = self.to_media(media)
         try:
-            if utils.is_pipe(media.path):
-                raise NotImplementedError('Read media information from a PIPE not yet implemented.')
-
-            return json.loads(
-                subprocess.check_output([
-                    self.executable,
-                    '-v', 'quiet',
-                    '-print_format', 'json',
-                    '-show_format',
-                    '-show_streams',
-                    media.path
-                ]).decode('utf-8'))
+            return self.mpd_class.parse(media, representations)
         except OSError as ex:
-            # Executable does not exist
             if fail or ex.errno == errno.ENOENT:
                 raise
         except Exception:  # pylint:disable=broad-except
@@ -99,13 +95,90 @@ class FFprobe(object):
                 raise
         return None
 
+    def get_media_info(self, media, fail=False):
+        """
+        Return a Python dictionary containing information about the media or None in case of error.
+        Set `media` to an instance of `self.media_class` or a path.
+        If `media` is a Python dictionary, then it is returned.
+
+        The media can also be read from a pipe (e.g. ``pipe:3``, a file descriptor of the calling
+        process), bytes, a binary file object or an iterable of chunks (bytes). Only the first
+        `probe_size` bytes are read (and fed to FFprobe), the media must be streamable (e.g.
+        MPEG-TS, Matroska or MP4 with the index at the beginning). The position of a seekable file
+        object is restored, an iterator is consumed up to the chunk crossing the limit.
+        """
+        return self._get_info(media, ['-show_format', '-show_streams'], fail)
+
+    def get_media_entries(self, media, *entries, select_streams=None, fail=False):
+        """
+        Return a Python dictionary containing only the requested entries of the information about
+        the media (a subset of `get_media_info()`) or None in case of error.
+        Set `media` to an instance of `self.media_class` or a path.
+        If `media` is a Python dictionary, then it is returned.
+
+        Set `entries` to one or multiple dictionaries mapping a section (*format* or *stream*) to
+        the names of the entries to retrieve, an empty list means all entries of the section.
+        Without any entry, all the entries of the format and the streams are retrieved.
+        Set `select_streams` to a stream specifier (e.g. *v* or *a:0*) to filter the streams.
+
+        Asking only for what is needed makes FFprobe faster and the output smaller.
+        """
+        return self._get_info(media, self._get_entries_arguments(entries, select_streams), fail)
+
+    def get_media_info_many(self, medias, max_workers=4, timeout=None, fail=False):
+        """
+        Yield a tuple (media, info) for every media in `medias` as soon as its information is
+        available (completion order, not input order).
+
+        Up to `max_workers` FFprobe processes are running concurrently, all of them driven by a
+        single asyncio event loop. Medias are consumed lazily, `medias` can be a generator.
+
+        If called from a running event loop (e.g. Jupyter, asynchronous services), the processes
+        are driven by an event loop running in a worker thread (the calling loop is blocked while
+        waiting for the results).
+
+        Set `timeout` to the maximum duration (in seconds) allowed to probe a media, its process is
+        killed when expired. Info is None in case of error (or time-out) unless `fail` is True.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            executor = None
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(1)  # Event loops cannot be nested
+
+        def run(awaitable):
+            if executor is None:
+                return loop.run_until_complete(awaitable)
+            return executor.submit(loop.run_until_complete, awaitable).result()
+
+        loop = asyncio.new_event_loop()
+        medias, pending = iter(medias), set()
+        try:
+            while True:
+                for media in itertools.islice(medias, max_workers - len(pending)):
+                    pending.add(loop.create_task(self._get_media_info_async(media, timeout, fail)))
+                if not pending:
+                    break
+                done, pending = run(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    yield task.result()
+        finally:
+            if pending:
+                for task in pending:
+                    task.cancel()
+                run(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+            if executor is not None:
+                executor.shutdown()
+
     def get_media_format(self, media, fail=False):
         """
         Return information about the container (and file) or None in case of error.
         Set `media` to an instance of `self.media_class`, a path or the output of
         `get_media_info()`.
         """
-        info = self.get_media_info(media, fail)
+        info = self.get_media_entries(media, {'format': []}, fail=fail)
         try:
             cls, the_format = self.format_class, info['format']
             if cls and not isinstance(the_format, cls):  # pylint:disable=all
@@ -116,13 +189,80 @@ class FFprobe(object):
                 raise
         return None
 
-    def get_media_streams(self, media, condition=lambda stream: True, fail=False):
+    def get_packet_index(self, media, select_streams='v:0', index_path=None, fail=False):
+        """
+        Return an instance of `self.packet_index_class` with the timestamps, size and flags of the
+        packets of the stream `select_streams` of `media` or None in case of error.
+        Set `media` to an instance of `self.media_class` or a path.
+
+        Only the required entries are retrieved, in a compact format parsed line by line.
+
+        Set `index_path` to a filename to store the index for later use. The index is loaded from
+        this file (and FFprobe not called) if the file is not older than the media and matches the
+        size of the media and `select_streams`. Otherwise the file is overwritten.
+        """
+        media = self.to_media(media)
+        try:
+            if index_path and (index := self._load_packet_index(media, select_streams, index_path)):
+                return index
+
+            arguments = self._get_info_arguments(media, [
+                '-select_streams', select_streams,
+                '-show_entries', 'stream=time_base:packet=pts,dts,size,flags'
+            ])
+            arguments[arguments.index('-print_format') + 1] = 'compact'
+            index = self.packet_index_class(
+                stream_specifier=select_streams,
+                media_size=os.path.getsize(media.path) if index_path else None)
+            process = py_subprocess.raw_cmd(
+                arguments,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL)
+            with process.stdout:
+                for line in process.stdout:
+                    section, *fields = line.rstrip().split(b'|')
+                    values = dict(f.split(b'=', 1) for f in fields if b'=' in f)
+                    if section == b'packet':
+                        index.append(values[b'pts'], values[b'dts'], values[b'size'],
+                                     values[b'flags'])
+                    elif section == b'stream':
+                        index.time_base = fractions.Fraction(values[b'time_base'].decode('ascii'))
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, arguments)
+            if index_path:
+                index.save(index_path)
+            return index
+        except OSError as ex:
+            # Executable does not exist
+            if fail or ex.errno == errno.ENOENT:
+                raise
+        except Exception:  # pylint:disable=broad-except
+            if fail:
+                raise
+        return None
+
+    def get_media_streams(  # pylint:disable=too-many-arguments
+        self,
+        media,
+        condition=lambda stream: True,
+        fail=False,
+        select_streams=None,
+        entries=None
+    ):
         """
         Return a list with the media streams of `media` or [] in case of error.
         Set `media` to an instance of `self.media_class`, a path or the output of
         `get_media_info()`.
+
+        Set `select_streams` to a stream specifier to let FFprobe filter the streams and `entries`
+        to the names of the entries to retrieve (default to all). Both are ignored if `media` is
+        the output of `get_media_info()`.
         """
-        info = self.get_media_info(media, fail)
+        info = self.get_media_entries(
+            media,
+            {'stream': entries or []},
+            select_streams=select_streams,
+            fail=fail)
         try:
             raw_streams = (s for s in info['streams'] if condition(s))
         except Exception:  # pylint:disable=broad-except
@@ -137,7 +277,7 @@ class FFprobe(object):
                 else stream)
         return streams
 
-    def get_audio_streams(self, media, fail=False):
+    def get_audio_streams(self, media, fail=False, entries=None):
         """
         Return a list with the audio streams of `media` or [] in case of error.
         Set `media` to an instance of `self.media_class`, a path or the output of
@@ -146,9 +286,11 @@ class FFprobe(object):
         return self.get_media_streams(
             media,
             condition=lambda s: s['codec_type'] == 'audio',
-            fail=fail)
+            fail=fail,
+            select_streams='a',
+            entries=entries)
 
-    def get_subtitle_streams(self, media, fail=False):
+    def get_subtitle_streams(self, media, fail=False, entries=None):
         """
         Return a list with the subtitle streams of `media` or [] in case of error.
         Set `media` to an instance of `self.media_class`, a path or the output of
@@ -157,9 +299,11 @@ class FFprobe(object):
         return self.get_media_streams(
             media,
             condition=lambda s: s['codec_type'] == 'subtitle',
-            fail=fail)
+            fail=fail,
+            select_streams='s',
+            entries=entries)
 
-    def get_video_streams(self, media, fail=False):
+    def get_video_streams(self, media, fail=False, entries=None):
         """
         Return a list with the video streams of `media` or [] in case of error.
         Set `media` to an instance of `self.media_class`, a path or the output of
@@ -168,7 +312,9 @@ class FFprobe(object):
         return self.get_media_streams(
             media,
             condition=lambda s: s['codec_type'] == 'video',
-            fail=fail)
+            fail=fail,
+            select_streams='v',
+            entries=entries)
 
     def get_video_frame_rate(self, media, index=0, fail=False):
         """
@@ -177,7 +323,7 @@ class FFprobe(object):
         `get_media_info()`.
         """
         try:
-            stream = self.get_video_streams(media)[index]
+            stream = self.get_video_streams(media, entries=['avg_frame_rate'])[index]
             if isinstance(stream, dict):
                 return utils.to_frame_rate(stream['avg_frame_rate'])
             else:
@@ -194,7 +340,7 @@ class FFprobe(object):
         `get_media_info()`.
         """
         try:
-            stream = self.get_video_streams(media)[index]
+            stream = self.get_video_streams(media, entries=['width', 'height'])[index]
             is_dict = isinstance(stream, dict)
             if is_dict:
                 return [int(stream['width']), int(stream['height'])]
@@ -204,5 +350,188 @@ class FFprobe(object):
                 raise
         return None
 
+    def query(self, media, *entries, select_streams=None, fail=False):
+        """
+        Return the requested entries of the information about the media converted to Python types
+        (e.g. int, float) or None in case of error. See `get_media_entries()` for the arguments.
+
+        Entries are converted by the cleanup methods of the classes in ``self.entries_classes``.
+
+        **Example usage**
+
+        >>> info = {
+        ...     'format': {'duration': '5.568000', 'format_name': 'mov', 'size': '383631'},
+        ...     'streams': [
+        ...         {'codec_type': 'video', 'avg_frame_rate': '30/1', 'height': '320'},
+        ...         {'codec_type': 'audio', 'codec_time_base': '1/50', 'sample_rate': '48000'}
+        ...     ]
+        ... }
+        >>> result = FFprobe().query(info)
+        >>> result['format']
+        {'duration': 5.568, 'format_name': 'mov', 'size': 383631}
+        >>> result['streams']
+        [{'codec_type': 'video', 'avg_frame_rate': 30.0, 'height': 320},
+         {'codec_type': 'audio', 'codec_time_base': 0.02, 'sample_rate': 48000}]
+        """
+        if (info := self.get_media_entries(
+            media,
+            *entries,
+            select_streams=select_streams,
+            fail=fail
+        )) is None:
+            return None
+        result = {}
+        if 'format' in info:
+            result['format'] = self._clean_entries(info['format'], self.entries_classes['format'])
+        if 'streams' in info:
+            result['streams'] = [
+                self._clean_entries(s, self.entries_classes.get(s.get('codec_type')))
+                for s in info['streams']
+            ]
+        return result
+
     def to_media(self, media):
         return media if isinstance(media, self.media_class) else self.media_class(media)
+
+    async def _get_media_info_async(self, media, timeout, fail):
+        """Asynchronous flavor of :meth:`get_media_info`, return a tuple (media, info)."""
+        if isinstance(media, dict):
+            return media, media
+        try:
+            the_media, data, process_kwargs = self._get_info_source(media)
+            arguments = self._get_info_arguments(the_media, ['-show_format', '-show_streams'])
+            process = await asyncio.create_subprocess_exec(
+                *arguments,
+                stdin=None if data is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                **process_kwargs)
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(data), timeout)
+            finally:
+                if process.returncode is None:
+                    py_subprocess.kill(process)
+                    await process.wait()
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, arguments, stdout)
+            return media, json.loads(stdout.decode('utf-8'))
+        except OSError as ex:
+            # Executable does not exist
+            if fail or ex.errno == errno.ENOENT:
+                raise
+        except Exception:  # pylint:disable=broad-except
+            if fail:
+                raise
+        return media, None
+
+    @staticmethod
+    def _clean_entries(entries, cls):
+        """Return `entries` converted by the cleanup methods of `cls` (and its codec class)."""
+        if cls is None:
+            return dict(entries)
+        codec_class = getattr(cls, 'codec_class', None)
+        cleaned = {}
+        for name, value in entries.items():
+            method = getattr(cls, f'clean_{name}', None)
+            if method is None and codec_class and name.startswith('codec_'):
+                method = getattr(codec_class, f"clean_{name.removeprefix('codec_')}", None)
+            cleaned[name] = value if method is None else method(value)
+        return cleaned
+
+    @staticmethod
+    def _get_entries_arguments(entries, select_streams=None):
+        """
+        Return the arguments to retrieve given `entries` (merged) and select the streams.
+
+        **Example usage**
+
+        >>> get = FFprobe._get_entries_arguments
+        >>> get([{'format': ['size', 'duration']}, {'stream': ['width']}, {'format': ['size']}])
+        ['-show_entries', 'format=duration,size:stream=codec_type,width']
+        >>> get([{'format': ['duration']}, {'format': []}, {'stream': ['width']}], 'v:0')
+        ['-show_entries', 'format:stream=codec_type,width', '-select_streams', 'v:0']
+        >>> get([]) == get([{}]) == ['-show_entries', 'format:stream']
+        True
+        """
+        sections = {}
+        for section, names in itertools.chain.from_iterable(e.items() for e in entries):
+            if section in sections and not sections[section] or not names:
+                sections[section] = set()
+            else:
+                sections.setdefault(section, set()).update(names)
+                if section == 'stream':
+                    sections[section].add('codec_type')  # Required to classify the streams
+        if not sections:
+            sections = {'format': set(), 'stream': set()}  # FFprobe rejects empty entries
+        arguments = ['-show_entries', ':'.join(
+            f"{section}={','.join(sorted(names))}" if names else section
+            for section, names in sorted(sections.items())
+        )]
+        if select_streams is not None:
+            arguments += ['-select_streams', select_streams]
+        return arguments
+
+    def _get_info(self, media, options, fail):
+        """Return the information about `media` as reported by FFprobe called with `options`."""
+        if isinstance(media, dict):
+            return media
+        try:
+            media, data, process_kwargs = self._get_info_source(media)
+            return json.loads(subprocess.check_output(
+                self._get_info_arguments(media, options),
+                input=data,
+                **process_kwargs).decode('utf-8'))
+        except OSError as ex:
+            # Executable does not exist
+            if fail or ex.errno == errno.ENOENT:
+                raise
+        except Exception:  # pylint:disable=broad-except
+            if fail:
+                raise
+        return None
+
+    def _get_info_arguments(self, media, options):
+        if media.is_pipe:
+            options = ['-probesize', str(self.probe_size), *options]
+        return [self.executable, '-v', 'quiet', '-print_format', 'json', *options, media.path]
+
+    def _get_info_source(self, media):
+        """
+        Return a tuple (media, data, process keyword arguments) to probe `media` (see
+        :meth:`get_media_info`). Data is None or the head of the media to feed to FFprobe's stdin.
+        """
+        if isinstance(media, (bytes, bytearray, memoryview)):
+            data = bytes(media[:self.probe_size])
+        elif hasattr(media, 'read'):
+            position = media.tell() if getattr(media, 'seekable', bool)() else None
+            data = media.read(self.probe_size)
+            if position is not None:
+                media.seek(position)
+        elif hasattr(media, '__iter__') and not isinstance(media, (str, self.media_class)):
+            chunks, size = [], 0
+            for chunk in media:
+                chunks.append(chunk)
+                if (size := size + len(chunk)) >= self.probe_size:
+                    break
+            data = b''.join(chunks)[:self.probe_size]
+        else:
+            media = self.to_media(media)
+            number = int(media.path.partition(':')[2] or 0) if media.is_pipe else 0
+            return media, None, {'pass_fds': (number, )} if number > 2 else {}
+        return self.media_class('pipe:0'), data, {}
+
+    def _load_packet_index(self, media, select_streams, index_path):
+        """
+        Return the packet index stored in `index_path` if up to date with `media` (and of the
+        stream `select_streams`) or None if outdated, missing or not a (complete) packet index.
+        """
+        try:
+            stat = os.stat(media.path)
+            if os.path.getmtime(index_path) < stat.st_mtime:
+                return None
+            index = self.packet_index_class.load(index_path)
+        except (OSError, ValueError):
+            return None
+        if index.stream_specifier != select_streams or index.media_size != stat.st_size:
+            return None
+        return index
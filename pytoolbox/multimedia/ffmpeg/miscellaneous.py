@@ -1,26 +1,100 @@
 from __future__ import annotations
 
 from pathlib import Path
+from xml.etree import ElementTree
+import array, collections, fractions, inspect, itertools, math, struct, sys
 
 from pytoolbox import comparison, filesystem, module, validation
 from pytoolbox.subprocess import to_args_list
-from pytoolbox.types import get_slots
 from . import utils
 
 _all = module.All(globals())
 
+NOPTS_VALUE = -2**63  # Same as FFmpeg's AV_NOPTS_VALUE
 
-class BaseInfo(  # pylint:disable=too-few-public-methods
+
+class BaseInfo(
     validation.CleanAttributesMixin,
     comparison.SlotsEqualityMixin
 ):
+    """
+    Information about a media (e.g. its format or a stream) with the attributes set from the
+    output of FFprobe and cleaned by the methods ``clean_<name>``.
+
+    The constructor is generated once per class: the attributes are set and cleaned in a straight
+    line, without looking up the slots and the cleanup methods for every instance (the
+    ``defaults`` are read for every instance). Classes overriding :meth:`_set_attribute` are
+    constructed the generic way.
+    """
 
     defaults = {}
     attr_name_template = '{name}'
 
     def __init__(self, info: dict):
-        for attr in get_slots(self):
-            self._set_attribute(attr, info)
+        self._get_constructor()(self, info)
+
+    def __eq__(self, other):
+        if not isinstance(other, BaseInfo):
+            return super().__eq__(other)
+        slots = self._get_slots()
+        return slots == other._get_slots() and all(
+            getattr(self, a) == getattr(other, a) for a in slots)
+
+    def to_dict(self) -> dict:
+        """Return a dictionary with the attributes not set to None (nested information included)."""
+        return {
+            attr: value.to_dict() if isinstance(value, BaseInfo) else value
+            for attr in self._get_slots() if (value := getattr(self, attr)) is not None
+        }
+
+    @classmethod
+    def _get_constructor(cls):
+        """Return the constructor of the class, generated at the first call."""
+        if (constructor := cls.__dict__.get('_constructor')) is None:
+            constructor = cls._constructor = cls._compile_constructor()
+        return constructor
+
+    @classmethod
+    def _get_slots(cls) -> tuple[str, ...]:
+        """Return the slots of the class (including those of the parent classes), sorted."""
+        if (slots := cls.__dict__.get('_slots')) is None:
+            slots = cls._slots = tuple(sorted(set(itertools.chain.from_iterable(
+                getattr(c, '__slots__', ()) for c in cls.__mro__))))
+        return slots
+
+    @classmethod
+    def _compile_constructor(cls):
+        """Return a function setting the attributes of an instance from an `info` dictionary."""
+        codec_class = getattr(cls, 'codec_class', None)
+        if cls._set_attribute is not BaseInfo._set_attribute:
+            def constructor(self, info):
+                for attr in cls._get_slots():
+                    if attr == 'codec' and codec_class:
+                        self.codec = codec_class(info)  # pylint:disable=not-callable
+                    else:
+                        self._set_attribute(attr, info)  # pylint:disable=protected-access
+            return constructor
+
+        namespace, lines = {'set_attribute': object.__setattr__}, [
+            'def constructor(self, info):',
+            '    get_default = type(self).defaults.get'  # Defaults may change after the compilation
+        ]
+        for number, name in enumerate(cls._get_slots()):
+            if name == 'codec' and codec_class:
+                namespace['codec_class'] = codec_class
+                value = 'codec_class(info)'
+            else:
+                key = cls.attr_name_template.format(name=name)
+                value = f'info.get({key!r}, get_default({name!r}))'
+            if (cleaner := inspect.getattr_static(cls, f'clean_{name}', None)) is not None:
+                namespace[f'clean_{number}'] = getattr(cls, f'clean_{name}')
+                if isinstance(cleaner, (classmethod, staticmethod)):
+                    value = f'clean_{number}({value})'
+                else:
+                    value = f'clean_{number}(self, {value})'
+            lines.append(f'    set_attribute(self, {name!r}, {value})')
+        exec('\n'.join([*lines, '    return None']), namespace)  # pylint:disable=exec-used
+        return namespace['constructor']
 
     def _set_attribute(self, name: str, info: dict) -> None:
         """Set attribute `name` value from the `info` or ``self.defaults`` dictionary."""
@@ -28,7 +102,7 @@ class BaseInfo(  # pylint:disable=too-few-public-methods
         setattr(self, name, value)
 
 
-class Codec(BaseInfo):  # pylint:disable=too-few-public-methods
+class Codec(BaseInfo):
 
     __slots__ = ('long_name', 'name', 'tag', 'tag_string', 'time_base', 'type')
 
@@ -90,13 +164,6 @@ class Stream(BaseInfo):
 
     codec_class = Codec
 
-    def __init__(self, info: dict):  # pylint:disable=super-init-not-called
-        for attr in get_slots(self):
-            if attr == 'codec':
-                self.codec = self.codec_class(info)
-            else:
-                self._set_attribute(attr, info)
-
     @staticmethod
     def clean_avg_frame_rate(value) -> float | None:
         return None if value is None else utils.to_frame_rate(value)
@@ -281,4 +348,517 @@ class Media(validation.CleanAttributesMixin, comparison.SlotsEqualityMixin):
         return self.options + (['-i', str(self.path)] if is_input else [str(self.path)])
 
 
+class PacketIndex(object):
+    """
+    The packets of a media stream stored in compact arrays (8 bytes per timestamp and size, 1 byte
+    for the flags). Timestamps are in `time_base` units, missing ones are set to `NOPTS_VALUE`.
+
+    The `stream_specifier` of the stream and the `media_size` (in bytes) of the media are stored
+    with the index to check the index matches the media when reused.
+
+    **Example usage**
+
+    >>> import os, tempfile
+    >>> index = PacketIndex('1/30', stream_specifier='v:0', media_size=4000)
+    >>> for pts, flags in ((0, 'K__'), (2, '___'), (1, '___'), (3, 'K__'), (b'N/A', b'_D_')):
+    ...     index.append(pts, pts, 1000, flags)
+    >>> len(index)
+    5
+    >>> index.keyframes
+    [0, 3]
+    >>> index.keyframes_times
+    [0.0, 0.1]
+    >>> index.pts.tolist() == [0, 2, 1, 3, NOPTS_VALUE]
+    True
+    >>> path = os.path.join(tempfile.gettempdir(), 'index.pkt')
+    >>> index.save(path)
+    >>> loaded = PacketIndex.load(path)
+    >>> loaded == index, loaded.stream_specifier, loaded.media_size
+    (True, 'v:0', 4000)
+    >>> os.remove(path)
+    """
+
+    FLAG_KEY, FLAG_DISCARD, FLAG_CORRUPT = 1, 2, 4
+
+    header = struct.Struct('<8sQqqqH')  # The stream specifier follows the header
+    magic = b'PTBXPKT2'
+
+    def __init__(
+        self,
+        time_base: fractions.Fraction | str | int = 1,
+        stream_specifier: str | None = None,
+        media_size: int | None = None
+    ):
+        self.time_base = fractions.Fraction(time_base)
+        self.stream_specifier = stream_specifier
+        self.media_size = media_size
+        self.pts = array.array('q')
+        self.dts = array.array('q')
+        self.size = array.array('q')
+        self.flags = array.array('B')
+
+    def __eq__(self, other):
+        return isinstance(other, PacketIndex) and all(
+            getattr(self, a) == getattr(other, a)
+            for a in ('time_base', 'pts', 'dts', 'size', 'flags'))
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+    @property
+    def keyframes(self) -> list[int]:
+        """Return the position of the keyframes in the index."""
+        return [i for i, flags in enumerate(self.flags) if flags & self.FLAG_KEY]
+
+    @property
+    def keyframes_times(self) -> list[float]:
+        """Return the presentation time (in seconds) of the keyframes."""
+        return [
+            float(self.pts[i] * self.time_base)
+            for i in self.keyframes if self.pts[i] != NOPTS_VALUE
+        ]
+
+    def append(self, pts, dts, size, flags) -> None:
+        """
+        Append a packet. Values can be given as reported by FFprobe (strings or bytes, N/A for
+        missing timestamps).
+        """
+        self.pts.append(self._to_timestamp(pts))
+        self.dts.append(self._to_timestamp(dts))
+        self.size.append(int(size))
+        if isinstance(flags, bytes):
+            flags = flags.decode('ascii')
+        if isinstance(flags, str):
+            flags = (
+                ('K' in flags and self.FLAG_KEY)
+                | ('D' in flags and self.FLAG_DISCARD)
+                | ('C' in flags and self.FLAG_CORRUPT))
+        self.flags.append(flags)
+
+    @classmethod
+    def load(cls, path: Path | str) -> PacketIndex:
+        """
+        Load an index from a file written by :meth:`save`.
+        Raise a :class:`ValueError` if the file is not a (complete) packet index.
+        """
+        with open(path, 'rb') as f:
+            try:
+                magic, count, numerator, denominator, media_size, length = \
+                    cls.header.unpack(f.read(cls.header.size))
+            except struct.error as ex:
+                raise ValueError(f'File {path} is not a packet index.') from ex
+            if magic != cls.magic:
+                raise ValueError(f'File {path} is not a packet index.')
+            index = cls(
+                fractions.Fraction(numerator, denominator),
+                f.read(length).decode('utf-8') or None,
+                None if media_size < 0 else media_size)
+            for values in index.pts, index.dts, index.size, index.flags:
+                try:
+                    values.fromfile(f, count)
+                except EOFError as ex:
+                    raise ValueError(f'File {path} is a truncated packet index.') from ex
+                if sys.byteorder == 'big':
+                    values.byteswap()
+        return index
+
+    def save(self, path: Path | str) -> None:
+        """Save the index to a binary file (little endian)."""
+        stream_specifier = (self.stream_specifier or '').encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(self.header.pack(
+                self.magic,
+                len(self),
+                self.time_base.numerator,
+                self.time_base.denominator,
+                -1 if self.media_size is None else self.media_size,
+                len(stream_specifier)))
+            f.write(stream_specifier)
+            for values in self.pts, self.dts, self.size, self.flags:
+                if sys.byteorder == 'big':
+                    values = array.array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+
+    def to_numpy(self) -> dict:
+        """Return a dictionary with the arrays converted to NumPy arrays (without any copy)."""
+        import numpy
+        return {
+            'pts': numpy.frombuffer(self.pts, dtype=numpy.int64),
+            'dts': numpy.frombuffer(self.dts, dtype=numpy.int64),
+            'size': numpy.frombuffer(self.size, dtype=numpy.int64),
+            'flags': numpy.frombuffer(self.flags, dtype=numpy.uint8)
+        }
+
+    @staticmethod
+    def _to_timestamp(value) -> int:
+        try:
+            return int(value)
+        except ValueError:
+            return NOPTS_VALUE
+
+
+class MediaCatalog(object):
+    """
+    The format and streams of many medias (outputs of :meth:`FFprobe.get_media_info`) stored by
+    column, one table for the formats and one per type of stream (*audio*, *subtitle* and *video*),
+    without creating any object per media or stream.
+
+    The columns are the slots of the classes used to represent the formats and streams (the
+    attributes of the codec are prefixed by *codec_*) and those values are cleaned by the same
+    methods, in batch (once for all the medias added since the last access), values that cannot
+    be cleaned are considered missing. Cleaned columns are stored in arrays of floats (NaN for
+    missing values), others in lists. The *media* column of every table is the position of the
+    media in the catalog (and in `names`).
+
+    **Example usage**
+
+    >>> catalog = MediaCatalog()
+    >>> catalog.add('a.mp4', {
+    ...     'format': {'bit_rate': '1000', 'duration': '60.0', 'format_name': 'mov'},
+    ...     'streams': [
+    ...         {'codec_type': 'video', 'codec_name': 'h264', 'width': 1280, 'height': 720},
+    ...         {'codec_type': 'audio', 'codec_name': 'aac', 'channels': 2}
+    ...     ]
+    ... })
+    >>> catalog.extend([('b.mkv', {'format': {'format_name': 'matroska'}, 'streams': [
+    ...     {'codec_type': 'video', 'codec_name': 'vp9', 'width': '640', 'height': '360'}
+    ... ]}), ('c.mp4', None)])
+    >>> len(catalog), catalog.names
+    (2, ['a.mp4', 'b.mkv'])
+    >>> catalog.column('format', 'bit_rate').tolist()
+    [1000.0, nan]
+    >>> catalog.column('video', 'codec_name'), catalog.column('video', 'height').tolist()
+    (['h264', 'vp9'], [720.0, 360.0])
+    >>> catalog.column('audio', 'media').tolist()
+    [0]
+    """
+
+    tables = {
+        'format': Format,
+        'audio': AudioStream,
+        'subtitle': SubtitleStream,
+        'video': VideoStream
+    }
+
+    def __init__(self):
+        self.names = []
+        self._columns = {table: {} for table in self.tables}
+        self._pending = {table: collections.defaultdict(list) for table in self.tables}
+        self._fields = {table: self._get_fields(cls) for table, cls in self.tables.items()}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name, info: dict | None) -> None:
+        """Add the information about a media, skipped if `info` is None (e.g. probing failed)."""
+        if info is None:
+            return
+        media = len(self.names)
+        self.names.append(name)
+        self._append('format', info.get('format', {}), media)
+        for stream in info.get('streams', []):
+            if stream.get('codec_type') in self._pending:
+                self._append(stream['codec_type'], stream, media)
+
+    def extend(self, items) -> None:
+        """Add medias from an iterable of (name, info), e.g. :meth:`FFprobe.get_media_info_many`."""
+        for name, info in items:
+            self.add(name, info)
+
+    def column(self, table: str, name: str):
+        """Return a column of a table (an array or a list)."""
+        self._flush(table)
+        return self._columns[table][name]
+
+    def columns(self, table: str) -> dict:
+        """Return the columns of a table."""
+        self._flush(table)
+        return self._columns[table]
+
+    def to_numpy(self, table: str) -> dict:
+        """Return the columns of a table converted to NumPy arrays (without copy if possible)."""
+        import numpy
+        return {
+            name: numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == 'd' else
+                                   numpy.int64)
+            if isinstance(column, array.array) else numpy.array(column, dtype=object)
+            for name, column in self.columns(table).items()
+        }
+
+    def to_pandas(self, table: str):
+        """Return a table as a :class:`pandas.DataFrame`."""
+        import pandas  # pylint:disable=import-error
+        return pandas.DataFrame(self.to_numpy(table))
+
+    def _append(self, table: str, info: dict, media: int) -> None:
+        pending = self._pending[table]
+        pending['media'].append(media)
+        for name, key, default, _ in self._fields[table]:
+            pending[name].append(info.get(key, default))
+
+    def _flush(self, table: str) -> None:
+        """Clean the values added since the last flush and append them to the columns."""
+        pending, columns = self._pending[table], self._columns[table]
+        if not columns:
+            columns['media'] = array.array('q')
+            for name, _, _, cleaner in self._fields[table]:
+                columns[name] = [] if cleaner is None else array.array('d')
+        if not pending:
+            return
+        columns['media'].extend(pending.pop('media'))
+        for name, _, _, cleaner in self._fields[table]:
+            values, column = pending.pop(name), columns[name]
+            if cleaner is not None:
+                values = [self._clean(cleaner, v) for v in values]
+                if isinstance(column, array.array):
+                    try:
+                        floats = array.array('d', (math.nan if v is None else v for v in values))
+                    except TypeError:
+                        column = columns[name] = [None if math.isnan(v) else v for v in column]
+                    else:
+                        column.extend(floats)
+                        continue
+            column.extend(values)
+
+    @staticmethod
+    def _clean(cleaner, value):
+        try:
+            return cleaner(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _get_fields(info_class) -> list[tuple]:
+        """Return a list of (column, key in the information, default value, cleaner or None)."""
+        fields = []
+        for name in info_class._get_slots():  # pylint:disable=protected-access
+            if name == 'codec':
+                codec_fields = MediaCatalog._get_fields(info_class.codec_class)
+                fields.extend((f'codec_{n}', *others) for n, *others in codec_fields)
+            else:
+                fields.append((
+                    name,
+                    info_class.attr_name_template.format(name=name),
+                    info_class.defaults.get(name),
+                    getattr(info_class, f'clean_{name}', None)))
+        return fields
+
+
+class SegmentTimeline(object):
+    """
+    The segments of a MPEG-DASH *SegmentTimeline* stored in compact arrays, one item per *S*
+    element: the start time (-1 if not set), duration and repeat count in `timescale` units.
+
+    **Example usage**
+
+    >>> timeline = SegmentTimeline(1000)
+    >>> timeline.append(0, 2000, 2)
+    >>> timeline.append(None, 1500)
+    >>> len(timeline)
+    4
+    >>> list(timeline)
+    [(0, 2000), (2000, 2000), (4000, 2000), (6000, 1500)]
+    >>> timeline.duration
+    7.5
+    """
+
+    def __init__(self, timescale: int | str = 1):
+        self.timescale = int(timescale)
+        self.starts = array.array('q')
+        self.durations = array.array('q')
+        self.repeats = array.array('q')
+
+    def __eq__(self, other):
+        return isinstance(other, SegmentTimeline) and all(
+            getattr(self, a) == getattr(other, a)
+            for a in ('timescale', 'starts', 'durations', 'repeats'))
+
+    def __iter__(self):
+        """Yield the (start, duration) of every segment (open-ended repeats are not expanded)."""
+        time = 0
+        for start, duration, repeat in zip(self.starts, self.durations, self.repeats):
+            time = time if start < 0 else start
+            for _ in range(max(0, repeat) + 1):
+                yield time, duration
+                time += duration
+
+    def __len__(self) -> int:
+        return len(self.repeats) + sum(r for r in self.repeats if r > 0)
+
+    @property
+    def duration(self) -> float:
+        """Return the duration of the segments in seconds."""
+        return sum(
+            d * (max(0, r) + 1) for d, r in zip(self.durations, self.repeats)
+        ) / self.timescale
+
+    def append(self, start, duration, repeat=0) -> None:
+        """Append a *S* element, values can be given as strings (start can be None)."""
+        self.starts.append(-1 if start is None else int(start))
+        self.durations.append(int(duration))
+        self.repeats.append(int(repeat))
+
+    def to_numpy(self) -> dict:
+        """Return a dictionary with the arrays converted to NumPy arrays (without any copy)."""
+        import numpy
+        return {
+            'starts': numpy.frombuffer(self.starts, dtype=numpy.int64),
+            'durations': numpy.frombuffer(self.durations, dtype=numpy.int64),
+            'repeats': numpy.frombuffer(self.repeats, dtype=numpy.int64)
+        }
+
+
+Representation = collections.namedtuple('Representation', [
+    'period',
+    'adaptation_set',
+    'id',
+    'content_type',
+    'mime_type',
+    'codecs',
+    'bandwidth',
+    'width',
+    'height',
+    'frame_rate',
+    'timeline'
+])
+
+
+class MPD(object):  # pylint:disable=too-few-public-methods
+    """
+    The attributes of the root element of a MPEG-DASH MPD and its representations (instances of
+    :class:`Representation`, with the segments of their timeline if any).
+
+    The manifest is parsed incrementally and the elements are cleared once handled, the memory does
+    not grow with the size of the manifest (e.g. thousands of *S* elements).
+
+    **Example usage**
+
+    >>> import io
+    >>> mpd = MPD.parse(io.BytesIO(b'''<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static">
+    ...   <Period id="p0"><AdaptationSet contentType="video" mimeType="video/mp4">
+    ...     <SegmentTemplate timescale="90000"><SegmentTimeline>
+    ...       <S t="0" d="180000" r="9"/><S d="90000"/>
+    ...     </SegmentTimeline></SegmentTemplate>
+    ...     <Representation id="720p" bandwidth="3000000" width="1280" height="720"/>
+    ...     <Representation id="360p" bandwidth="800000" width="640" height="360"/>
+    ...   </AdaptationSet></Period>
+    ... </MPD>'''))
+    >>> mpd.attributes
+    {'type': 'static'}
+    >>> [(r.period, r.id, r.content_type, r.bandwidth, r.height) for r in mpd.representations]
+    [('p0', '720p', 'video', 3000000, 720), ('p0', '360p', 'video', 800000, 360)]
+    >>> timeline = mpd.representations[0].timeline
+    >>> len(timeline), timeline.duration
+    (11, 21.0)
+    """
+
+    timeline_class = SegmentTimeline
+
+    def __init__(self, attributes: dict | None = None, representations: list | None = None):
+        self.attributes = attributes or {}
+        self.representations = representations or []
+
+    @classmethod
+    def parse(  # pylint:disable=too-many-statements
+        cls,
+        source,
+        representations: bool = True
+    ) -> MPD:
+        """
+        Parse a MPD from `source` (a path or a binary file object).
+        Set `representations` to False to only parse the root element (stop reading the source).
+
+        Raise a :class:`ValueError` if the root element is not a MPD.
+        """
+        if not hasattr(source, 'read'):
+            with open(source, 'rb') as f:
+                return cls.parse(f, representations)
+        mpd = None
+        adaptation = representation = timeline = None
+        periods = adaptation_sets = 0
+        period, timescales, timelines = None, {}, {}
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            tag = element.tag.rpartition('}')[2]
+            # The segment templates are inherited from the period to the representations
+            scope = 'representation' if representation else 'adaptation' if adaptation else 'period'
+            if event == 'start':
+                if mpd is None:
+                    if tag != 'MPD':
+                        raise ValueError(f'Root element {tag} is not a MPD.')
+                    mpd = cls(dict(element.attrib))
+                    if not representations:
+                        break
+                elif tag == 'Period':
+                    period = element.get('id', str(periods))
+                    periods += 1
+                elif tag == 'AdaptationSet':
+                    adaptation = dict(element.attrib, id=element.get('id', str(adaptation_sets)))
+                    adaptation_sets += 1
+                elif tag == 'Representation':
+                    representation = dict(element.attrib)
+                elif tag == 'SegmentTemplate':
+                    timescales[scope] = element.get('timescale', cls._get_scoped(timescales, 1))
+                elif tag == 'SegmentTimeline':
+                    timeline = cls.timeline_class(cls._get_scoped(timescales, 1))
+            elif tag == 'S':
+                if timeline is not None:  # Ignored outside of a timeline
+                    timeline.append(element.get('t'), element.get('d'), element.get('r', 0))
+                element.clear()
+            elif tag == 'SegmentTimeline':
+                if timeline is not None:
+                    timelines[scope] = timeline
+                    timeline = None
+                element.clear()
+            elif tag == 'Representation':
+                mpd.representations.append(cls._to_representation(
+                    period,
+                    adaptation or {},
+                    representation,
+                    cls._get_scoped(timelines)))
+                representation = None
+                timescales.pop('representation', None)
+                timelines.pop('representation', None)
+                element.clear()
+            elif tag == 'AdaptationSet':
+                adaptation = None
+                for scoped in timescales, timelines:
+                    scoped.pop('representation', None)
+                    scoped.pop('adaptation', None)
+                element.clear()
+            elif tag == 'Period':
+                adaptation = representation = None
+                timescales.clear()
+                timelines.clear()
+                element.clear()
+        return mpd
+
+    @staticmethod
+    def _get_scoped(values: dict, default=None):
+        """Return the value of the innermost scope (representation, adaptation set, period)."""
+        for scope in 'representation', 'adaptation', 'period':
+            if scope in values:
+                return values[scope]
+        return default
+
+    @staticmethod
+    def _to_representation(period, adaptation, attributes, timeline) -> Representation:
+        def to_int(name):
+            value = attributes.get(name, adaptation.get(name))
+            return None if value is None else int(value)
+        frame_rate = attributes.get('frameRate', adaptation.get('frameRate'))
+        return Representation(
+            period=period,
+            adaptation_set=adaptation.get('id'),
+            id=attributes.get('id'),
+            content_type=attributes.get('contentType', adaptation.get('contentType')),
+            mime_type=attributes.get('mimeType', adaptation.get('mimeType')),
+            codecs=attributes.get('codecs', adaptation.get('codecs')),
+            bandwidth=to_int('bandwidth'),
+            width=to_int('width'),
+            height=to_int('height'),
+            frame_rate=None if frame_rate is None else utils.to_frame_rate(frame_rate),
+            timeline=timeline)
+
+
 __all__ = _all.diff(globals())
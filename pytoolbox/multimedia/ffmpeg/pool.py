@@ -0,0 +1,189 @@
+# pylint:disable=protected-access
+import heapq, itertools, os, selectors, threading
+
+from pytoolbox import subprocess as py_subprocess
+from . import encode, ffmpeg
+
+__all__ = ['EncodeJob', 'EncodePool']
+
+
+class EncodeJob(object):  # pylint:disable=too-many-instance-attributes
+    """
+    An encoding queued in (or processed by) an :class:`EncodePool`. Arguments are those of
+    :meth:`FFmpeg.encode`, jobs with a higher `priority` are started first.
+
+    The resources used by the process (and its children) are sampled at every update if psutil is
+    installed: `cpu_time` (user + system, in seconds), `memory` and `peak_memory` (resident set
+    size, in bytes). They are None otherwise.
+    """
+
+    states = encode.EncodeState
+
+    def __init__(
+        self,
+        inputs,
+        outputs,
+        in_options=None,
+        out_options=None,
+        priority=0,
+        create_directories=True,
+        process_kwargs=None,
+        statistics_kwargs=None
+    ):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.in_options = in_options
+        self.out_options = out_options
+        self.priority = priority
+        self.create_directories = create_directories
+        self.process_kwargs = process_kwargs
+        self.statistics_kwargs = statistics_kwargs
+
+        self.cancelled = False
+        self.process = None
+        self.statistics = None
+        self.cpu_time = None
+        self.memory = None
+        self.peak_memory = None
+
+    @property
+    def state(self):
+        return self.statistics.state if self.statistics else self.states.NEW
+
+    def update_resources(self):
+        """Sample the resources used by the process and its children (requires psutil)."""
+        if not hasattr(self.process, 'cpu_times'):
+            return
+        cpu_time = memory = 0
+        try:
+            for process in (self.process, *self.process.children(recursive=True)):
+                times = process.cpu_times()
+                cpu_time += times.user + times.system
+                memory += process.memory_info().rss
+        except py_subprocess.NoSuchProcess:
+            return  # Process ended, keep the last sample
+        self.cpu_time = max(self.cpu_time or 0, cpu_time)
+        self.memory = memory
+        self.peak_memory = max(self.peak_memory or 0, memory)
+
+
+class EncodePool(object):
+    """
+    Run encodings with at most `max_workers` concurrent processes (default to the number of CPUs),
+    the jobs with the highest priority first then in submission order.
+
+    The progress of all the processes is watched by a single selector, in the thread iterating on
+    :meth:`run`. Jobs can be submitted and cancelled from any thread.
+
+    **Example usage**
+
+    >> pool = EncodePool(max_workers=2)
+    >> jobs = [pool.submit(f'{name}.mp4', f'{name}.mkv') for name in ('a', 'b', 'c')]
+    >> urgent = pool.submit('d.mp4', 'd.mkv', priority=10)
+    >> for job in pool.run():
+    ..     print(job.outputs, job.state, job.statistics.ratio, job.cpu_time, job.peak_memory)
+    """
+
+    encoder_class = ffmpeg.FFmpeg
+    job_class = EncodeJob
+
+    def __init__(self, max_workers=None, encoder=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.encoder = encoder or self.encoder_class()
+        self.running = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._queue = []
+
+    @property
+    def pending(self):
+        """The jobs waiting to be started, highest priority first."""
+        with self._lock:
+            return [job for *_, job in sorted(self._queue) if not job.cancelled]
+
+    def submit(self, *args, **kwargs):
+        """Queue a job (created with given arguments, see :class:`EncodeJob`) and return it."""
+        job = self.job_class(*args, **kwargs)
+        with self._lock:
+            heapq.heappush(self._queue, (-job.priority, next(self._counter), job))
+        return job
+
+    def cancel(self, job):
+        """
+        Cancel `job`, kill its process and the children of the process if it is running.
+        A job cancelled before being started is never started (nor yielded by :meth:`run`).
+
+        Return False if the job is already ended.
+        """
+        with self._lock:
+            if job.state in job.states.FINAL_STATES:
+                return False
+            job.cancelled = True
+            if job.process is not None:
+                py_subprocess.kill(job.process, recursive=True)
+        return True
+
+    def run(self):
+        """
+        Run the queued jobs (including those submitted meanwhile) and yield the jobs whose
+        statistics are updated, until all the jobs are ended.
+
+        The running processes are killed if the generator is closed before the end.
+        """
+        jobs = {}
+        try:
+            with selectors.DefaultSelector() as selector:
+                while True:
+                    while len(self.running) < self.max_workers and (job := self._pop()):
+                        self._start(selector, job)
+                        jobs[id(job.statistics)] = job
+                        yield job
+                    if not self.running:
+                        with self._lock:
+                            if not self._queue:
+                                break
+                        continue
+                    updated = {id(s): jobs[id(s)] for s in self.encoder._select(selector)}
+                    for job in updated.values():
+                        job.update_resources()
+                        if job.state in job.states.FINAL_STATES:
+                            self.running.remove(job)
+                            del jobs[id(job.statistics)]
+                            job.process.progress.close()
+                            job.process.stderr.close()
+                            job.statistics.close()
+                        yield job
+        finally:
+            for job in self.running:
+                if job.process.poll() is None:
+                    py_subprocess.kill(job.process, recursive=True)
+                    job.process.wait()
+                job.process.progress.close()
+                job.process.stderr.close()
+                job.statistics.close()
+            self.running = []
+
+    def _pop(self):
+        """Return the next job to start (skipping the cancelled ones) or None."""
+        with self._lock:
+            while self._queue:
+                if not (job := heapq.heappop(self._queue)[-1]).cancelled:
+                    return job
+        return None
+
+    def _start(self, selector, job):
+        process, statistics = self.encoder._create_encode(
+            job.inputs,
+            job.outputs,
+            job.in_options,
+            job.out_options,
+            job.create_directories,
+            job.process_kwargs,
+            job.statistics_kwargs)
+        with self._lock:
+            job.process, job.statistics = process, statistics
+            if job.cancelled:
+                py_subprocess.kill(process, recursive=True)
+        self.running.append(job)
+        self.encoder._register_process(selector, process, statistics.start(process))
+        job.update_resources()
@@ -3,6 +3,7 @@ import fnmatch, re
 from .itertools import chain
 
 __all__ = [
+    'PathMatcher',
     'TIME_REGEX_PARTS',
     'UUID_REGEX',
     'embed_in_regex',
@@ -78,6 +79,65 @@ def from_path_patterns(patterns, regex=False):
     ]
 
 
+class PathMatcher(object):  # pylint:disable=too-few-public-methods
+    """
+    Match paths against any of the patterns (see :func:`from_path_patterns`), merged to make the
+    cost of matching a path (almost) independent of the number of patterns:
+
+    * The unix-style wildcards made of a star followed by a literal (e.g. ``*.mp4``) are matched
+      with :meth:`str.endswith` and the literals (no wildcard at all) by a lookup in a set.
+    * The other patterns are merged into a single regular expression, except those that cannot be
+      (with flags or groups).
+
+    **Example usage**
+
+    >>> matcher = PathMatcher(['*.mp4', '*.MP4', 'README', '*/a?c/*'])
+    >>> matcher.suffixes, matcher.literals, len(matcher.patterns)
+    (('.mp4', '.MP4'), {'README'}, 0)
+    >>> [matcher.match(p) for p in ('/v/movie.mp4', 'README', '/v/abc/d', '/v/ac/d', '/README')]
+    [True, True, True, False, False]
+    >>> PathMatcher('*').match('anything')
+    True
+    >>> matcher = PathMatcher(['.*[.]py$', re.compile('.*/setup[.]cfg$', re.I)], regex=True)
+    >>> matcher.regex.pattern, [p.pattern for p in matcher.patterns]
+    ('(?:.*[.]py$)', ['.*/setup[.]cfg$'])
+    >>> [matcher.match(p) for p in ('a/b.py', 'a/SETUP.cfg', 'a/b.pyc')]
+    [True, True, False]
+    """
+
+    wildcards_regex = re.compile(r'[*?[]')
+
+    def __init__(self, patterns, regex=False):
+        self.literals, suffixes, compiled = set(), [], []
+        for pattern in chain(patterns):
+            if hasattr(pattern, 'match'):
+                compiled.append(pattern)
+            elif regex:
+                compiled.append(re.compile(pattern))
+            elif not self.wildcards_regex.search(pattern):
+                self.literals.add(pattern)
+            elif pattern[0] == '*' and not self.wildcards_regex.search(pattern, 1):
+                suffixes.append(pattern[1:])
+            else:
+                compiled.append(re.compile(fnmatch.translate(pattern)))
+        self.suffixes = tuple(suffixes)
+        mergeable = [
+            p for p in compiled
+            if isinstance(p.pattern, str) and not p.groups and not p.flags & ~re.UNICODE
+        ]
+        self.regex = re.compile('|'.join(f'(?:{p.pattern})' for p in mergeable)) \
+            if mergeable else None
+        self.patterns = [p for p in compiled if p not in mergeable]
+
+    def match(self, path):
+        """Return True if `path` matches any of the patterns."""
+        return (
+            path in self.literals
+            or path.endswith(self.suffixes)
+            or (self.regex is not None and self.regex.match(path) is not None)
+            or any(p.match(path) for p in self.patterns))
+
+
 class Match(object):
     """
     Assert that a given string meets some expectations.
@@ -23,8 +23,17 @@ except ImportError:
     from pipes import quote  # pylint: disable=deprecated-module
 
 
-def kill(process):
+def kill(process, recursive=False):
+    """
+    Kill `process`, ignoring the error if the process is already terminated.
+
+    Set `recursive` to True to also kill its children, recursively (requires psutil, the process
+    must be an instance of :class:`psutil.Popen`).
+    """
+    children = []
     try:
+        if recursive and hasattr(process, 'children'):
+            children = process.children(recursive=True)
         process.kill()
     except OSError as ex:
         if ex.errno != errno.ESRCH:
@@ -32,6 +41,8 @@ def kill(process):
     except Exception as ex:  # pylint:disable=broad-except
         if not NoSuchProcess or not isinstance(ex, NoSuchProcess):
             raise
+    for child in children:
+        kill(child)
 
 
 def su(user, group):  # pylint:disable=invalid-name
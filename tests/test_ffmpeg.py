@@ -1,10 +1,12 @@
 # pylint:disable=too-few-public-methods
-import datetime, shutil, uuid
+import asyncio, datetime, io, json, math, os, shutil, subprocess, uuid
 from pathlib import Path
+from unittest import mock
 
 import pytest
 from pytoolbox import filesystem
 from pytoolbox.multimedia import ffmpeg
+from pytoolbox.multimedia.ffmpeg import benchmark
 
 MPD_TEST = """<?xml version="1.0"?>
 <MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT0H6M7.83S">
@@ -152,6 +154,85 @@ def test_media_pipe():
         assert media.size == 0
 
 
+def test_base_info_constructor():
+
+    class GenericVideoStream(ffmpeg.VideoStream):
+        def _set_attribute(self, name, info):  # pylint:disable=useless-parent-delegation
+            super()._set_attribute(name, info)
+
+    info = SMALL_MP4_MEDIA_INFOS['streams'][0]
+    video, generic = ffmpeg.VideoStream(info), GenericVideoStream(info)
+    assert video == generic
+    assert video.to_dict() == generic.to_dict()
+    assert video.to_dict()['codec'] == {
+        'long_name': 'H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10',
+        'name': 'h264',
+        'tag': '0x31637661',
+        'tag_string': 'avc1',
+        'time_base': 1 / 60,
+        'type': 'video'
+    }
+    assert video.to_dict()['avg_frame_rate'] == 30.0
+    assert video.to_dict()['width'] == 560
+    assert video.to_dict()['has_b_frames'] == 0
+    assert 'bit_per_raw_sample' not in video.to_dict()  # Not set
+    assert video != ffmpeg.VideoStream({**info, 'width': '1280'})
+    assert video != ffmpeg.AudioStream(SMALL_MP4_MEDIA_INFOS['streams'][1])
+
+    # The defaults are read for every instance
+    class DefaultVideoStream(ffmpeg.VideoStream):
+        defaults = {'height': 720}
+
+    class OtherDefaultVideoStream(DefaultVideoStream):
+        defaults = {'height': 1080}
+
+    assert DefaultVideoStream({}).to_dict()['height'] == 720
+    DefaultVideoStream.defaults = {'height': 480}
+    assert DefaultVideoStream({}).to_dict()['height'] == 480
+    assert OtherDefaultVideoStream({}).to_dict()['height'] == 1080
+
+
+def test_media_catalog():
+    catalog = ffmpeg.MediaCatalog()
+    catalog.extend([('small.mp4', SMALL_MP4_MEDIA_INFOS), ('missing.mp4', None)])
+    catalog.add('other.mkv', {'format': {'bit_rate': 'oops'}, 'streams': [{'codec_type': 'data'}]})
+    assert len(catalog) == 2
+    assert catalog.names == ['small.mp4', 'other.mkv']
+
+    # Same values as the objects, cleaned by the same methods
+    the_format = ffmpeg.Format(SMALL_MP4_MEDIA_INFOS['format'])
+    video = ffmpeg.VideoStream(SMALL_MP4_MEDIA_INFOS['streams'][0])
+    for name in 'bit_rate', 'duration', 'nb_streams', 'format_name', 'tags':
+        assert catalog.column('format', name)[0] == getattr(the_format, name)
+    for name in 'avg_frame_rate', 'width', 'height', 'pix_fmt':
+        assert catalog.column('video', name)[0] == getattr(video, name)
+    for name in 'name', 'time_base':
+        assert catalog.column('video', f'codec_{name}')[0] == video.to_dict()['codec'][name]
+    assert list(catalog.column('audio', 'media')) == [0]
+    assert not catalog.column('subtitle', 'media')
+
+    assert math.isnan(catalog.column('format', 'bit_rate')[1])  # Cannot be cleaned
+
+
+def test_media_catalog_mixed_column():
+    class Format(ffmpeg.Format):
+        __slots__ = ()
+
+        @staticmethod
+        def clean_format_name(value):
+            return value  # Not always a number
+
+    class Catalog(ffmpeg.MediaCatalog):
+        tables = {'format': Format}
+
+    catalog = Catalog()
+    for name, value in ('a', 1), ('b', 2), ('c', 'mov'):
+        catalog.add(name, {'format': {'format_name': value}})
+    assert catalog.column('format', 'format_name') == [1, 2, 'mov']
+    catalog.add('d', {'format': {'format_name': 3}})
+    assert catalog.column('format', 'format_name') == [1, 2, 'mov', 3]
+
+
 def test_statistics_compute_ratio(statistics):
     statistics.input.duration = datetime.timedelta(seconds=0)
     statistics.output.duration = None
@@ -203,6 +284,73 @@ def test_statistics_parse_chunk(statistics):
     }
 
 
+def test_statistics_parse_report():
+    parse = ffmpeg.EncodeStatistics._parse_report  # pylint:disable=protected-access
+    assert parse({'progress': 'continue'}) is None
+    assert parse({'out_time_us': 'N/A', 'progress': 'continue'}) is None
+    assert parse({
+        'frame': '2071',
+        'fps': '0.00',
+        'stream_0_0_q': '-1.0',
+        'bitrate': '3302.3kbits/s',
+        'total_size': '35453952',
+        'out_time_us': '85890000',
+        'progress': 'continue'
+    }) == {
+        'frame': 2071,
+        'frame_rate': 0.0,
+        'qscale': -1.0,
+        'size': 35453952,
+        'time': datetime.timedelta(minutes=1, seconds=25.89),
+        'bit_rate': 3302300
+    }
+    assert parse({
+        'bitrate': 'N/A',
+        'total_size': 'N/A',
+        'out_time_ms': '-1000',
+        'progress': 'end'
+    }) == {
+        'frame': 0,
+        'frame_rate': 0.0,
+        'qscale': None,
+        'size': None,
+        'time': datetime.timedelta(0),
+        'bit_rate': None
+    }
+
+
+def test_statistics_process_output(statistics, tmp_path):
+    statistics.process_output_limit = 100
+    statistics.process_output_path = tmp_path / 'output.log'
+    statistics.start('process')
+    statistics.progress('frame= 2071 fps=  0 q=-1.0 size=   34623kB ')
+    assert statistics.frame == 0
+    statistics.progress('time=00:01:25.89 bitrate=3302.3kbits/s\r')
+    assert statistics.frame == 2071
+    for index in range(100):
+        statistics.progress(f'Line {index}\n')
+    assert statistics.process_output == ''.join(f'Line {i}\n' for i in range(100))[-100:]
+    statistics.end(1)
+    assert statistics.process_output.endswith('Line 99\n')
+    with open(statistics.process_output_path, encoding='utf-8') as f:
+        assert f.read().endswith(''.join(f'Line {i}\n' for i in range(100)))
+
+
+def test_statistics_process_output_closed(static_ffmpeg, small_mp4, tmp_path):
+    path = tmp_path / 'output.log'
+    encodes = static_ffmpeg().encode(
+        ffmpeg.Media(small_mp4),
+        ffmpeg.Media(tmp_path / 'output.mp4', '-c:a copy -c:v copy'),
+        statistics_kwargs={'process_output_path': path})
+    statistics = next(encodes)
+    statistics._append_output('Line\n')  # pylint:disable=protected-access
+    output_file = statistics._output_file  # pylint:disable=protected-access
+    assert not output_file.closed
+    encodes.close()  # Before the end of the encoding
+    assert output_file.closed
+    assert path.read_text(encoding='utf-8').startswith('Line\n')
+
+
 def test_statistics_subclip_duration_and_size(statistics):
     subclip = statistics._get_subclip_duration_and_size  # pylint:disable=protected-access
     size = 512 * 1024
@@ -280,6 +428,13 @@ def test_ffmpeg_encode(static_ffmpeg, small_mp4, tmp_path):
     assert filesystem.remove(tmp_path / 'output.mp4') is False
     assert results[-1].state == ffmpeg.EncodeState.FAILURE
 
+    results = list(encoder.encode(
+        ffmpeg.Media(small_mp4),
+        ffmpeg.Media(tmp_path / 'output.mp4', '-c:a copy -c:v copy')))
+    assert results[-1].state == ffmpeg.EncodeState.SUCCESS
+    assert results[-1].output.duration is not None
+    assert filesystem.remove(tmp_path / 'output.mp4') is True
+
     results = list(encoder.encode(
         [ffmpeg.Media('missing.mp4')],
         ffmpeg.Media(tmp_path / 'output.mp4', '-c:a copy -c:v copy')))
@@ -287,6 +442,32 @@ def test_ffmpeg_encode(static_ffmpeg, small_mp4, tmp_path):
     assert results[-1].state == ffmpeg.EncodeState.FAILURE
 
 
+def test_ffmpeg_encode_probe_once(static_ffmpeg, small_mp4, tmp_path):
+    encoder = static_ffmpeg()
+    media_info = encoder.ffprobe.get_media_info(small_mp4)
+
+    with mock.patch('subprocess.check_output') as check_output:
+        results = list(encoder.encode(
+            ffmpeg.Media(small_mp4),
+            ffmpeg.Media(tmp_path / 'output.mp4', '-c:a copy -c:v copy'),
+            statistics_kwargs={'media_info': media_info}))
+    check_output.assert_not_called()
+    assert results[-1].state == ffmpeg.EncodeState.SUCCESS
+    assert results[-1].input.duration == datetime.timedelta(seconds=5.568)
+    assert results[-1].output.duration > datetime.timedelta(seconds=5)
+    assert results[-1].output.size == filesystem.get_size(tmp_path / 'output.mp4')
+
+
+def test_ffmpeg_deprecated_arguments(static_ffmpeg, small_mp4, tmp_path):
+    with pytest.warns(DeprecationWarning):
+        encoder = static_ffmpeg(None, 0.5, 0.5, 'latin-1')
+    assert encoder.encoding == 'latin-1'
+    with pytest.warns(DeprecationWarning):
+        results = list(encoder.encode(
+            small_mp4, tmp_path / 'output.mp4', None, '-c:a copy -c:v copy', True, True))
+    assert results[-1].state == ffmpeg.EncodeState.SUCCESS
+
+
 def test_ffmpeg_get_arguments():
     get = ffmpeg.FFmpeg()._get_arguments  # pylint:disable=protected-access
 
@@ -330,6 +511,197 @@ def test_ffmpeg_get_process(static_ffmpeg):
     assert process.args == [str(executable), '-y', '-i', 'in.mp4', *options, 'out.mkv']
 
 
+def test_ffmpeg_get_frames_checksums(static_ffmpeg, small_mp4):
+    encoder = static_ffmpeg()
+
+    checksums = list(encoder.get_frames_checksums(small_mp4))
+    assert {c.stream for c in checksums} == {0, 1}
+    assert len([c for c in checksums if c.stream == 0]) == 166
+    assert all(len(c.hash) == 32 for c in checksums)
+    assert static_ffmpeg.get_frames_md5_checksum(small_mp4) == checksums[0].hash
+    assert static_ffmpeg.get_frames_md5_checksum('missing.mp4') is None
+
+    checksums = list(encoder.get_frames_checksums(
+        small_mp4,
+        algorithm='crc32',
+        streams=['v:0'],
+        start=1,
+        duration=1))
+    assert len(checksums) == 30
+    assert all(c.stream == 0 and len(c.hash) == 8 for c in checksums)
+
+    assert not list(encoder.get_frames_checksums('missing.mp4'))
+    with pytest.raises(subprocess.CalledProcessError):
+        list(encoder.get_frames_checksums('missing.mp4', fail=True))
+
+
+def test_ffmpeg_encode_renditions(static_ffmpeg, tmp_path):
+    encoder = static_ffmpeg()
+    renditions = [
+        ffmpeg.Rendition(tmp_path / 'high.mkv', 320, 240, ['-b:v', '1M']),
+        ffmpeg.Rendition(tmp_path / 'low.mkv', height=120, options=['-q:v', '10']),
+        ffmpeg.Rendition(tmp_path / 'same.mkv', options=['-q:v', '20'])
+    ]
+    with mock.patch('pytoolbox.filesystem.get_size', side_effect=filesystem.get_size) as get_size:
+        results = list(encoder.encode_renditions(
+            ffmpeg.Media('testsrc=duration=2:size=640x480:rate=25', ['-f', 'lavfi']),
+            renditions,
+            out_options=['-c:v', 'mpeg4'],
+            statistics_kwargs={'process_output_limit': 1000}))
+    # The size of the outputs is read once ended
+    assert [c.args[0] for c in get_size.call_args_list[-3:]] == [r.output for r in renditions]
+    assert get_size.call_count == 4  # And the size of the input
+    assert len(results) > 1
+    assert all(len(statistics) == 3 for statistics in results)
+    for statistics, rendition in zip(results[-1], renditions):
+        assert statistics.state == ffmpeg.EncodeState.SUCCESS, statistics.process_output
+        assert statistics.output.path == rendition.output
+        assert statistics.frame == 50
+        assert statistics.output.size == filesystem.get_size(rendition.output)
+        assert statistics.bit_rate > 0
+        assert statistics.process_output_limit == 1000
+    assert [s.qscale for s in results[-1][1:]] == [10.0, 20.0]  # The quality of every rendition
+    assert [
+        (s['width'], s['height'])
+        for r in renditions for s in encoder.ffprobe.get_video_streams(r.output)
+    ] == [(320, 240), (160, 120), (640, 480)]
+
+    results = list(encoder.encode_renditions('missing.mp4', renditions))
+    assert [s.state for s in results[-1]] == [ffmpeg.EncodeState.FAILURE] * 3
+
+
+def test_ffmpeg_encode_segmented(static_ffmpeg, tmp_path):
+    encoder = static_ffmpeg()
+    the_input, output = tmp_path / 'input.mkv', tmp_path / 'output' / 'output.mkv'
+    process = encoder(
+        '-v', 'error',
+        '-f', 'lavfi', '-i', 'testsrc=duration=8:size=160x120:rate=25',
+        '-f', 'lavfi', '-i', 'sine=duration=8',
+        '-c:v', 'mpeg4', '-g', '25', '-c:a', 'aac', str(the_input))
+    assert process.wait() == 0
+
+    results = []
+    for statistics in encoder.encode_segmented(
+        the_input,
+        output,
+        out_options=['-c:v', 'mpeg4', '-c:a', 'aac', '-metadata', 'title=Segmented'],
+        segments=4,
+        max_workers=2
+    ):
+        results.append(statistics)
+        if statistics.state in statistics.states.FINAL_STATES:
+            # The size of the output file, not the sum of the sizes of the segments
+            assert statistics.output.size == filesystem.get_size(output)
+    statistics = results[-1]
+    assert statistics.state == ffmpeg.EncodeState.SUCCESS, statistics.process_output
+    assert statistics.frame == 200
+    assert statistics.ratio == 1.0
+    assert statistics.output.size == filesystem.get_size(output)
+    assert os.listdir(output.parent) == ['output.mkv']
+    assert len(encoder.ffprobe.get_packet_index(output)) == 200
+    media_info = encoder.ffprobe.get_media_info(output)
+    assert [s['codec_type'] for s in media_info['streams']] == ['video', 'audio']
+    assert media_info['format']['tags']['title'] == 'Segmented'  # Muxer options are kept
+
+    results = list(encoder.encode_segmented(the_input, output, out_options=['-c:v', 'unknown']))
+    assert results[-1].state == ffmpeg.EncodeState.FAILURE
+    assert os.listdir(output.parent) == ['output.mkv']
+
+    # The segments are cut relatively to the start time of the input
+    the_input = tmp_path / 'input-offset.mp4'
+    process = encoder(
+        '-v', 'error',
+        '-f', 'lavfi', '-i', 'testsrc=duration=8:size=160x120:rate=25',
+        '-c:v', 'mpeg4', '-g', '25', '-output_ts_offset', '10', str(the_input))
+    assert process.wait() == 0
+    assert float(encoder.ffprobe.get_media_info(the_input)['format']['start_time']) == 10
+    get_segments = encoder._get_segments  # pylint:disable=protected-access
+    with mock.patch.object(encoder, '_get_segments', side_effect=get_segments) as get_segments:
+        results = list(encoder.encode_segmented(
+            the_input,
+            output,
+            out_options=['-c:v', 'mpeg4'],
+            segments=4,
+            max_workers=2))
+    assert get_segments.call_args.args[:2] == ([float(s) for s in range(8)], 8.0)
+    assert results[-1].state == ffmpeg.EncodeState.SUCCESS, results[-1].process_output
+    assert results[-1].frame == 200
+    assert len(encoder.ffprobe.get_packet_index(output)) == 200
+
+    # Falls back to a plain encoding if the duration of the input is unknown
+    with mock.patch.object(encoder.ffprobe_class, 'get_media_duration', return_value=None), \
+            mock.patch.object(encoder.ffprobe_class, 'get_packet_index') as get_packet_index:
+        results = list(encoder.encode_segmented(
+            the_input, output, out_options=['-c:v', 'mpeg4', '-c:a', 'aac']))
+    get_packet_index.assert_not_called()
+    assert results[-1].state == ffmpeg.EncodeState.SUCCESS, results[-1].process_output
+    assert results[-1].frame == 200
+
+
+def test_benchmark(static_ffmpeg, tmp_path):
+    output = tmp_path / 'results.json'
+    benchmark.main([
+        '--ffmpeg', str(static_ffmpeg.executable),
+        '--ffprobe', str(static_ffmpeg.ffprobe_class.executable),
+        '--duration', '1',
+        '--size', '160x120',
+        '--repeat', '1',
+        '--jobs', '2',
+        '--segments', '100',
+        '--output', str(output)
+    ])
+    results = json.loads(output.read_text(encoding='utf-8'))
+    assert results['parameters'] == {'duration': 1, 'size': '160x120', 'repeat': 1}
+    benchmarks = results['benchmarks']
+    assert set(benchmarks) == {
+        'spawn', 'get_media_info', 'frames_checksum', 'encode', 'pool', 'mpd'
+    }
+    assert set(benchmarks['spawn']) == {'ffmpeg', 'ffprobe'}
+    assert benchmarks['encode']['wrapper']['updates'] > 0
+    assert benchmarks['encode']['memory']['samples']
+    assert benchmarks['pool']['sequential']['throughput'] > 0
+    assert benchmarks['mpd']['segments'] == 100
+
+
+def test_encode_pool(static_ffmpeg, tmp_path):
+    pool = ffmpeg.EncodePool(max_workers=2, encoder=static_ffmpeg())
+
+    def submit(name, duration, priority):
+        return pool.submit(
+            ffmpeg.Media(f'testsrc=duration={duration}:size=160x120:rate=25', ['-f', 'lavfi']),
+            tmp_path / f'{name}.mkv',
+            out_options=['-c:v', 'mpeg4'],
+            priority=priority)
+
+    jobs = [submit(f'job-{i}', 2, priority=i % 2) for i in range(4)]
+    endless = submit('endless', 3600, priority=-1)
+    cancelled = submit('cancelled', 2, priority=-2)
+    assert pool.cancel(cancelled)
+    assert pool.pending == [jobs[1], jobs[3], jobs[0], jobs[2], endless]
+
+    started = []
+    for job in pool.run():
+        assert len(pool.running) <= 2
+        if job not in started:
+            started.append(job)
+        if job is endless and job.statistics.frame and not job.cancelled:
+            assert pool.cancel(job)
+    assert started == [jobs[1], jobs[3], jobs[0], jobs[2], endless]
+    assert not pool.running
+    assert not pool.pending
+    for job in jobs:
+        assert job.state == ffmpeg.EncodeState.SUCCESS
+        assert job.statistics.frame == 50
+        assert not job.cancelled
+    assert endless.state == ffmpeg.EncodeState.FAILURE
+    assert endless.cancelled
+    assert not pool.cancel(endless)
+    assert cancelled.state == ffmpeg.EncodeState.NEW
+    assert cancelled.statistics is None
+    if hasattr(endless.process, 'cpu_times'):
+        assert all(job.cpu_time >= 0 and job.peak_memory > 0 for job in (*jobs, endless))
+
+
 def test_ffmpeg_kill_process_handle_missing(static_ffmpeg, small_mp4, tmp_path):
 
     class SomeError(Exception):
@@ -391,6 +763,32 @@ def test_ffprobe_get_media_duration(static_ffmpeg, small_mp4, tmp_path):
     assert probe.get_media_duration(probe.get_media_info(small_mp4), as_delta=True).seconds == 5
 
 
+def test_ffprobe_get_media_info_many(static_ffmpeg, small_mp4):
+    probe = static_ffmpeg.ffprobe_class()
+
+    info = probe.get_media_info(small_mp4)
+    medias = [small_mp4, 'missing.mp4', info, ffmpeg.Media(small_mp4)]
+    results = list(probe.get_media_info_many(medias, max_workers=2))
+    assert sorted(results, key=lambda r: medias.index(r[0])) == [
+        (small_mp4, info),
+        ('missing.mp4', None),
+        (info, info),
+        (ffmpeg.Media(small_mp4), info)
+    ]
+
+    with pytest.raises(Exception):
+        list(probe.get_media_info_many(['missing.mp4'], fail=True))
+
+    # From a running event loop
+    async def get_media_info_many():
+        return list(probe.get_media_info_many([small_mp4, 'missing.mp4']))
+
+    assert sorted(asyncio.run(get_media_info_many()), key=lambda r: r[1] is None) == [
+        (small_mp4, info),
+        ('missing.mp4', None)
+    ]
+
+
 def test_ffprobe_get_media_format(static_ffmpeg, small_mp4):
     probe = static_ffmpeg.ffprobe_class()
 
@@ -409,6 +807,41 @@ def test_ffprobe_get_media_format(static_ffmpeg, small_mp4):
     assert media_format.probe_score == 100
 
 
+def test_ffprobe_get_media_entries(static_ffmpeg, small_mp4):
+    probe = static_ffmpeg.ffprobe_class()
+
+    info = probe.get_media_entries(small_mp4, {'format': ['duration']}, {'stream': ['width']})
+    assert info['format'] == {'duration': '5.568000'}
+    assert info['streams'] == [{'codec_type': 'video', 'width': 560}, {'codec_type': 'audio'}]
+
+    info = probe.get_media_entries(small_mp4, {'stream': []}, select_streams='a')
+    assert info['streams'] == [probe.get_media_info(small_mp4)['streams'][1]]
+    assert 'format' not in info
+
+    # Without any entry, retrieve everything (FFprobe rejects empty entries)
+    assert probe.get_media_entries(small_mp4) == probe.get_media_entries(small_mp4, {}) == \
+        probe.get_media_entries(small_mp4, {'format': [], 'stream': []})
+    assert probe.get_media_entries(small_mp4)['format']['filename'] == str(small_mp4)
+
+    assert probe.get_media_entries('missing.mp4', {'format': []}) is None
+    assert probe.get_media_entries(SMALL_MP4_MEDIA_INFOS, {'format': []}) is SMALL_MP4_MEDIA_INFOS
+
+
+def test_ffprobe_query(static_ffmpeg, small_mp4):
+    probe = static_ffmpeg.ffprobe_class()
+
+    assert probe.query(
+        small_mp4,
+        {'format': ['duration', 'size']},
+        {'stream': ['avg_frame_rate', 'codec_time_base']},
+        select_streams='v'
+    ) == {
+        'format': {'duration': 5.568, 'size': 383631},
+        'streams': [{'avg_frame_rate': 30.0, 'codec_time_base': 1 / 60, 'codec_type': 'video'}]
+    }
+    assert probe.query('missing.mp4', {'format': []}) is None
+
+
 def test_ffprobe_get_media_info_errors_handling(static_ffmpeg):
     probe = static_ffmpeg.ffprobe_class()
 
@@ -417,6 +850,132 @@ def test_ffprobe_get_media_info_errors_handling(static_ffmpeg):
         probe.get_media_info('another.mp4', fail=False)
 
 
+def test_ffprobe_get_mpd(tmp_path):
+    probe = ffmpeg.FFprobe()
+    path = tmp_path / 'live.mpd'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            '<?xml version="1.0"?>\n'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT1H0M0S">\n'
+            '<Period id="0">\n'
+            '<AdaptationSet contentType="audio" codecs="mp4a.40.2">\n'
+            '<Representation id="audio" bandwidth="128000"/>\n'
+            '</AdaptationSet>\n'
+            '<AdaptationSet contentType="video" mimeType="video/mp4" frameRate="25">\n'
+            '<Representation id="video" bandwidth="3000000" width="1280" height="720">\n'
+            '<SegmentTemplate timescale="1000"><SegmentTimeline>\n')
+        for number in range(10000):
+            f.write(f'<S t="{number * 360}" d="360"/>\n')
+        f.write('</SegmentTimeline></SegmentTemplate>\n</Representation>\n')
+        f.write('</AdaptationSet>\n</Period>\n</MPD>\n')
+
+    mpd = probe.get_mpd(path)
+    assert mpd.attributes == {'mediaPresentationDuration': 'PT1H0M0S'}
+    audio, video = mpd.representations
+    assert audio == ffmpeg.Representation(
+        '0', '0', 'audio', 'audio', None, 'mp4a.40.2', 128000, None, None, None, None)
+    assert video[:-1] == ('0', '1', 'video', 'video', 'video/mp4', None, 3000000, 1280, 720, 25.0)
+    assert len(video.timeline) == 10000
+    assert video.timeline.duration == 3600.0
+    assert list(video.timeline)[-1] == (3599640, 360)
+    assert probe.get_media_duration(path, as_delta=True) == datetime.timedelta(hours=1)
+
+    with pytest.raises(FileNotFoundError):
+        probe.get_mpd(tmp_path / 'missing.mpd')
+    (tmp_path / 'not.mpd').write_text('<html/>', encoding='utf-8')
+    assert probe.get_mpd(tmp_path / 'not.mpd') is None
+    with pytest.raises(ValueError):
+        probe.get_mpd(tmp_path / 'not.mpd', fail=True)
+    assert probe.get_media_duration(tmp_path / 'not.mpd') is None
+
+
+def test_mpd_parse_scopes():
+    mpd = ffmpeg.MPD.parse(io.BytesIO(
+        b'<MPD xmlns="urn:mpeg:dash:schema:mpd:2011">'
+        b'<Period><S t="0" d="1000"/>'
+        b'<AdaptationSet contentType="video">'
+        b'<SegmentTemplate timescale="1000"><SegmentTimeline><S t="0" d="2000" r="1"/>'
+        b'</SegmentTimeline></SegmentTemplate>'
+        b'<Representation id="video"/>'
+        b'</AdaptationSet>'
+        b'<AdaptationSet contentType="audio">'
+        b'<Representation id="audio"><SegmentTemplate><SegmentTimeline><S t="0" d="3"/>'
+        b'</SegmentTimeline></SegmentTemplate></Representation>'
+        b'<Representation id="no-timeline"/>'
+        b'</AdaptationSet>'
+        b'</Period></MPD>'))
+    video, audio, no_timeline = mpd.representations
+    assert video.timeline.duration == 4.0
+    assert audio.timeline.timescale == 1  # Not inherited from the previous adaptation set
+    assert audio.timeline.duration == 3.0
+    assert no_timeline.timeline is None
+
+
+def test_ffprobe_get_media_info_from_stream(static_ffmpeg, tmp_path):
+    path = tmp_path / 'media.mkv'
+    process = static_ffmpeg()(
+        '-v', 'error',
+        '-f', 'lavfi', '-i', 'testsrc=duration=5:size=320x240:rate=25',
+        '-c:v', 'mpeg4', str(path))
+    assert process.wait() == 0
+    data = path.read_bytes()
+    ffprobe = static_ffmpeg.ffprobe_class(probe_size=32 * 1024)
+    assert len(data) > 2 * ffprobe.probe_size
+
+    def check(info):
+        assert info['format']['format_name'] == 'matroska,webm'
+        assert [(s['width'], s['height']) for s in info['streams']] == [(320, 240)]
+
+    check(ffprobe.get_media_info(data))
+    with path.open('rb') as f:
+        f.seek(10)
+        ffprobe.get_media_info(f)
+        assert f.tell() == 10
+        f.seek(0)
+        check(ffprobe.get_media_info(f))
+        assert f.tell() == 0
+    chunks = iter([data[i:i + 1000] for i in range(0, len(data), 1000)])
+    check(ffprobe.get_media_info(chunks))
+    assert len(list(chunks)) == len(data) // 1000 - 32
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        check(ffprobe.get_media_info(f'pipe:{file_descriptor}'))
+    finally:
+        os.close(file_descriptor)
+    assert ffprobe.get_video_resolution(data) == [320, 240]
+
+
+def test_ffprobe_get_packet_index(static_ffmpeg, small_mp4, tmp_path):
+    probe = static_ffmpeg.ffprobe_class()
+
+    index = probe.get_packet_index(small_mp4)
+    assert len(index) == 166
+    assert str(index.time_base) == '1/90000'
+    assert index.keyframes[0] == 0
+    assert index.keyframes_times[0] == 0.0
+    assert sum(index.size) > 0
+
+    index_path = tmp_path / 'small.pkt'
+    assert probe.get_packet_index(small_mp4, index_path=index_path) == index
+    assert index_path.exists()
+    with mock.patch('pytoolbox.subprocess.raw_cmd') as raw_cmd:
+        assert probe.get_packet_index(small_mp4, index_path=index_path) == index
+    raw_cmd.assert_not_called()
+
+    # The index of another stream is not reused, the file is overwritten
+    audio_index = probe.get_packet_index(small_mp4, select_streams='a', index_path=index_path)
+    assert audio_index == probe.get_packet_index(small_mp4, select_streams='a') != index
+    assert ffmpeg.PacketIndex.load(index_path).stream_specifier == 'a'
+
+    # A truncated index is probed again
+    index_path.write_bytes(index_path.read_bytes()[:100])
+    assert probe.get_packet_index(small_mp4, index_path=index_path) == index
+    assert ffmpeg.PacketIndex.load(index_path) == index
+
+    assert len(probe.get_packet_index(small_mp4, select_streams='a')) == 261
+    assert probe.get_packet_index('missing.mp4') is None
+
+
 def test_ffprobe_get_video_streams(static_ffmpeg, small_mp4):
     probe = static_ffmpeg.ffprobe_class()
 
@@ -1,6 +1,8 @@
+import asyncio, errno, os, wave
 from pathlib import Path
 from unittest import mock
 
+import magic, pytest
 from pytoolbox import filesystem
 
 
@@ -21,12 +23,348 @@ def test_chown(tmp_path):
         filesystem.chown(tmp_path, 100, 'root')
     chown.assert_called_once_with(tmp_path, 100, 0)
 
+    for max_workers, follow_symlinks in (1, True), (2, True), (1, False):
+        with mock.patch('os.chown') as chown:
+            filesystem.chown(
+                tmp_path, 100, 'root',
+                recursive=True,
+                max_workers=max_workers,
+                follow_symlinks=follow_symlinks)
+        assert chown.call_count == 5
+        chown.assert_has_calls([
+            mock.call(str(tmp_path), 100, 0),
+            mock.call(file_b.name, 100, 0, dir_fd=mock.ANY, follow_symlinks=follow_symlinks),
+            mock.call(file_a.name, 100, 0, dir_fd=mock.ANY, follow_symlinks=follow_symlinks),
+            mock.call(file_c.parent.name, 100, 0, dir_fd=mock.ANY, follow_symlinks=follow_symlinks),
+            mock.call(file_c.name, 100, 0, dir_fd=mock.ANY, follow_symlinks=follow_symlinks),
+        ], any_order=True)
+
+    with pytest.raises(TypeError, match='unsupported keyword arguments: follow_links'):
+        filesystem.chown(tmp_path, 100, recursive=True, follow_links=True)
+
+    # Entries already owned are skipped
     with mock.patch('os.chown') as chown:
-        filesystem.chown(tmp_path, 100, 'root', recursive=True)
-    chown.assert_has_calls([
-        mock.call(str(tmp_path), 100, 0),
-        mock.call(str(file_b), 100, 0),
-        mock.call(str(file_a), 100, 0),
-        mock.call(str(file_c.parent), 100, 0),
-        mock.call(str(file_c), 100, 0),
-    ], any_order=True)
+        filesystem.chown(tmp_path, os.getuid(), os.getgid(), recursive=True)
+    chown.assert_not_called()
+
+
+def test_recursive_copy(tmp_path):
+    source = tmp_path / 'source'
+    (source / 'a' / 'b').mkdir(parents=True)
+    (source / 'empty').mkdir()
+    (source / 'small.txt').write_text('small')
+    (source / 'a' / 'big.bin').write_bytes(b'0123456789' * 300000)
+    (source / 'a' / 'b' / 'zero.bin').touch()
+
+    def check(destination, **kwargs):
+        progress = []
+        result = filesystem.recursive_copy(
+            str(source),
+            str(destination),
+            progress_callback=lambda *args: progress.append(args),
+            ratio_delta=0,
+            time_delta=0,
+            **kwargs)
+        assert result['src_size'] == 3000005
+        assert progress and progress[-1][-1] == 1.0
+        assert (destination / 'empty').is_dir()
+        for path in source.rglob('*'):
+            if path.is_file():
+                assert (destination / path.relative_to(source)).read_bytes() == path.read_bytes()
+
+    check(tmp_path / 'kernel')
+
+    # Fallback to the block-copy
+    error = OSError(errno.EXDEV, 'Invalid cross-device link')
+    with mock.patch('fcntl.ioctl', side_effect=error), \
+            mock.patch('os.copy_file_range', side_effect=error), \
+            mock.patch('os.sendfile', side_effect=error):
+        check(tmp_path / 'block', max_workers=1)
+
+    # Remove the destination on error
+    with mock.patch('os.sendfile', side_effect=OSError(errno.EIO, 'I/O error')), \
+            mock.patch('os.copy_file_range', side_effect=OSError(errno.EIO, 'I/O error')), \
+            pytest.raises(OSError):
+        filesystem.recursive_copy(str(source), str(tmp_path / 'error'))
+    assert not (tmp_path / 'error').exists()
+
+
+def test_get_size(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'file.txt').write_bytes(b'x' * 100)
+    (tmp_path / 'a' / 'b' / 'file.bin').write_bytes(b'x' * 1000)
+    (tmp_path / 'link.txt').hardlink_to(tmp_path / 'a' / 'file.txt')
+    (tmp_path / 'symlink').symlink_to(tmp_path / 'a', target_is_directory=True)
+    for max_workers in 1, 4:
+        assert filesystem.get_size(tmp_path, max_workers=max_workers) == 1200
+        assert filesystem.get_size(tmp_path, max_workers=max_workers, hardlinks=False) == 1100
+        assert filesystem.get_size(tmp_path, '*.txt', max_workers=max_workers) == 200
+        assert filesystem.get_size(tmp_path, max_workers=max_workers, followlinks=True) == 2300
+        with pytest.raises(TypeError, match='unsupported keyword arguments: follow_links'):
+            filesystem.get_size(tmp_path, max_workers=max_workers, follow_links=True)
+    assert filesystem.get_size(tmp_path / 'a' / 'file.txt') == 100
+
+
+def test_find_recursive(tmp_path):
+    for path in (
+        'a.mp4', 'b.MP4', 'c.txt', 'movies/d.mp4', 'movies/e.mkv', 'movies/old/f.mp4',
+        'build/g.mp4', 'logs/h.log', 'logs/keep.log'
+    ):
+        filesystem.makedirs(tmp_path / path, parent=True)
+        (tmp_path / path).touch()
+
+    def find(*args, **kwargs):
+        return sorted(
+            Path(p).relative_to(tmp_path).as_posix()
+            for p in filesystem.find_recursive(tmp_path, *args, **kwargs))
+
+    assert find('*.mp4') == ['a.mp4', 'build/g.mp4', 'movies/d.mp4', 'movies/old/f.mp4']
+    assert find(['*.mp4', '*.MP4'], max_depth=0) == ['a.mp4', 'b.MP4']
+    assert find('*.mp4', exclude=['*/build', '*/old']) == ['a.mp4', 'movies/d.mp4']
+    assert find(['*/movies/*', '*.txt'], ignore=['old/', '*.mkv']) == ['c.txt', 'movies/d.mp4']
+    assert find('*.log', ignore=['/logs/*', '!keep.log']) == ['logs/keep.log']
+    assert find(['.*/[a-c]\\.[^/]+$'], regex=True) == ['a.mp4', 'b.MP4', 'c.txt']
+
+
+def test_manifest(tmp_path):
+    directory, database = tmp_path / 'data', tmp_path / 'manifest.db'
+    (directory / 'logs').mkdir(parents=True)
+    (directory / 'a.bin').write_bytes(b'a')
+    (directory / 'b.bin').write_bytes(b'b')
+    (directory / 'logs' / 'c.log').write_bytes(b'c')
+
+    with filesystem.Manifest(directory, database, exclude='*/logs') as manifest:
+        assert manifest.update(commit=False).added == ['a.bin', 'b.bin']
+        assert len(manifest) == 0
+        assert manifest.update().added == ['a.bin', 'b.bin']
+        assert [e.path for e in manifest] == ['a.bin', 'b.bin']
+        assert manifest.get('a.bin').checksum is None
+
+    # Same size and modification time but replaced (another inode)
+    stat = (directory / 'b.bin').stat()
+    (tmp_path / 'b.bin').write_bytes(b'B')
+    os.utime(tmp_path / 'b.bin', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path / 'b.bin', directory / 'b.bin')
+
+    with filesystem.Manifest(directory, database, exclude='*/logs') as manifest:
+        assert manifest.update() == filesystem.ManifestChanges([], [], ['b.bin'])
+        assert manifest.update() == filesystem.ManifestChanges([], [], [])
+
+
+def test_files_mimes(tmp_path):
+    sound, text, empty = tmp_path / 'sound.wav', tmp_path / 'text.txt', tmp_path / 'empty'
+    with wave.Wave_write(str(sound)) as f:
+        f.setparams((1, 2, 8000, 0, 'NONE', 'not compressed'))
+        f.writeframes(b'\x00\x01' * 8000)
+    text.write_text('Some text.\n')
+    empty.touch()
+    paths = [sound, text, empty, tmp_path, tmp_path / 'missing']
+    expected = [
+        'audio/x-wav',  # From the signature, whatever the version of libmagic
+        magic.from_file(str(text), mime=True),
+        magic.from_file(str(empty), mime=True),
+        None,
+        None
+    ]
+
+    cache = {}
+    with mock.patch('magic.Magic.from_buffer', autospec=True, side_effect=magic.Magic.from_buffer) \
+            as from_buffer:
+        for max_workers in 1, 4:
+            assert list(filesystem.files_mimes(paths, cache=cache, max_workers=max_workers)) == \
+                list(zip(paths, expected))
+    from_buffer.assert_called_once()  # Only the text, the sound matched its signature
+    assert len(cache) == 3
+
+    # The results are cached by size of the header
+    with mock.patch('magic.Magic.from_buffer', autospec=True, return_value='text/x-short') \
+            as from_buffer:
+        assert filesystem.file_mime(text, cache=cache, header_size=4) == 'text/x-short'
+    assert from_buffer.call_args.args[1] == b'Some'
+    assert filesystem.file_mime(text, cache=cache) == expected[1]
+    assert len(cache) == 4
+
+
+def test_delta_copy(tmp_path):
+    source, destination = tmp_path / 'source.bin', tmp_path / 'destination.bin'
+    journal = tmp_path / 'destination.journal'
+    source.write_bytes(os.urandom(100 * 1024))
+
+    # Interrupted then resumed
+    def interrupt(length):
+        processed.append(length)
+        if len(processed) == 5:
+            raise KeyboardInterrupt
+
+    processed = []
+    with pytest.raises(KeyboardInterrupt):
+        filesystem.delta_copy(source, destination, 4096, journal, callback=interrupt)
+    with mock.patch('os.pread', wraps=os.pread) as pread:
+        assert filesystem.delta_copy(source, destination, 4096, journal) == 20 * 4096
+    assert pread.call_count == 2 + 20  # Journal and the blocks not in the journal
+    assert destination.read_bytes() == source.read_bytes()
+
+    # Only the modified blocks are written, the destination is not read
+    data = bytearray(source.read_bytes())
+    data[5000:5010] = b'x' * 10
+    source.write_bytes(data[:-100])
+    with mock.patch('os.pread', wraps=os.pread) as pread:
+        assert filesystem.delta_copy(source, destination, 4096, journal) == 4096 + 4096 - 100
+    assert pread.call_count == 2
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_recursive_copy_delta(tmp_path):
+    source, destination = tmp_path / 'source', tmp_path / 'destination'
+    (source / 'a').mkdir(parents=True)
+    for name in 'a/b.bin', 'c.bin', 'd.bin':
+        (source / name).write_bytes(os.urandom(50000))
+    filesystem.recursive_copy(str(source), str(destination), delta=True)
+
+    (source / 'c.bin').write_bytes(b'header' + (source / 'c.bin').read_bytes()[6:])
+    with mock.patch('pytoolbox.filesystem.delta_copy', wraps=filesystem.delta_copy) as delta_copy:
+        filesystem.recursive_copy(
+            str(source),
+            str(destination),
+            delta=True,
+            journal_directory=str(tmp_path / 'journals'))
+    delta_copy.assert_called_once()
+    assert (tmp_path / 'journals' / 'c.bin.journal').exists()
+    for name in 'a/b.bin', 'c.bin', 'd.bin':
+        assert (destination / name).read_bytes() == (source / name).read_bytes()
+        assert (destination / name).stat().st_mtime_ns == (source / name).stat().st_mtime_ns
+
+
+def test_from_template_jinja2(tmp_path):
+    jinja2 = pytest.importorskip('jinja2')
+    base, child = tmp_path / 'base.j2', tmp_path / 'child.j2'
+    base.write_text('[{% block content %}{% endblock %}]')
+    child.write_text('{% extends "base.j2" %}{% block content %}{{ name }}{% endblock %}')
+
+    def render(name, **kwargs):
+        return filesystem.from_template(
+            str(child), None, {'name': name}, jinja2=True, directories=[tmp_path], **kwargs)
+
+    compile_template = jinja2.Environment.compile
+    with mock.patch('jinja2.Environment.compile', autospec=True, side_effect=compile_template) \
+            as compile_:
+        assert [render(n) for n in ('a', 'b', 'c')] == ['[a]', '[b]', '[c]']
+        assert compile_.call_count == 2  # The child and the base template, once
+
+        # The base template is reloaded if modified
+        base.write_text('<{% block content %}{% endblock %}>')
+        os.utime(base, ns=(0, base.stat().st_mtime_ns + 10**9))
+        assert render('d') == '<d>'
+        assert compile_.call_count == 3
+
+        assert render('e', cache=False) == '<e>'
+        assert compile_.call_count == 5
+
+    bytecode = tmp_path / 'bytecode'
+    bytecode.mkdir()
+    assert render('f', bytecode_directory=str(bytecode)) == '<f>'
+    assert list(bytecode.iterdir())
+
+
+def test_temp_storage_pool(tmp_path):
+    disk, memory = tmp_path / 'disk', tmp_path / 'memory'
+    disk.mkdir()
+    memory.mkdir()
+    with filesystem.TempStorage(
+        root=str(disk),
+        pool=True,
+        memory_root=str(memory),
+        memory_budget=1000,
+        pool_size=1
+    ) as storage:
+        path = storage.create_tmp_file(encoding=None, return_file=False, size=600)
+        assert os.path.dirname(path) == str(memory)
+        Path(path).write_bytes(b'a' * 500)
+        assert storage.memory_reserved == 600
+        assert storage.memory_usage == 500
+
+        # Spilled to disk once the budget is exceeded
+        assert os.path.dirname(storage.create_tmp_file(size=500, return_file=False)) == str(disk)
+        directory = storage.create_tmp_directory(key='job', size=400)
+        assert os.path.dirname(directory) == str(memory)
+        (Path(directory) / 'sub').mkdir()
+        (Path(directory) / 'sub' / 'file').write_bytes(b'b' * 300)
+        other = storage.create_tmp_directory(key='job', size=200)
+        assert os.path.dirname(other) == str(disk)
+        assert os.path.dirname(storage.create_tmp_directory()) == str(disk)  # Unknown size
+
+        # Directories are emptied and recycled (one per root), without changing the owner
+        assert storage.memory_reserved == 1000
+        storage.remove_by_key('job')
+        assert storage.memory_reserved == 600
+        assert os.listdir(directory) == os.listdir(other) == []
+        with mock.patch('os.chown') as chown:
+            recycled = storage.create_tmp_directory(user=os.getuid(), group=os.getgid(), size=0)
+        chown.assert_not_called()
+        assert os.path.dirname(recycled) == str(memory)
+        assert not os.path.exists(directory)
+        assert os.path.isdir(recycled)
+        storage.remove_by_path(recycled)
+        assert os.path.isdir(recycled)
+    assert storage.memory_reserved == 0
+    assert os.listdir(memory) == os.listdir(disk) == []
+
+
+def test_watcher(tmp_path):
+    watched, outside = tmp_path / 'watched', tmp_path / 'outside'
+    watched.mkdir()
+    (outside / 'tree' / 'sub').mkdir(parents=True)
+    (outside / 'tree' / 'sub' / 'b.txt').write_text('b')
+
+    def get_events(watcher):
+        return {
+            os.path.relpath(e.path, watched): (e.flags, e.completed)
+            for e in watcher.events(timeout=0.2)
+        }
+
+    with filesystem.Watcher(delay=0.05, exclude=['*.tmp']) as watcher:
+        watcher.add(watched, recursive=True)
+
+        # Events of a path are coalesced, the temporary files are excluded
+        with open(watched / 'a.txt', 'w', encoding='utf-8') as f:
+            for _ in range(100):
+                f.write('a')
+                f.flush()
+        (watched / 'a.tmp').write_text('a')
+        events = get_events(watcher)
+        assert list(events) == ['a.txt']
+        flags = filesystem.WatchFlags
+        assert events['a.txt'] == (flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE, True)
+
+        # Trees moved in are watched and their entries reported
+        (outside / 'tree').rename(watched / 'tree')
+        events = get_events(watcher)
+        assert events == {
+            'tree': (flags.MOVED_TO | flags.ISDIR, False),
+            'tree/sub': (flags.MOVED_TO | flags.ISDIR, False),
+            'tree/sub/b.txt': (flags.MOVED_TO, True)
+        }
+        assert watcher.paths == {str(watched), str(watched / 'tree'), str(watched / 'tree/sub')}
+        (watched / 'tree' / 'sub' / 'b.txt').unlink()
+        assert get_events(watcher) == {'tree/sub/b.txt': (flags.DELETE, False)}
+
+        # Moved inside the tree, the watches follow
+        (watched / 'tree').rename(watched / 'moved')
+        (watched / 'moved' / 'sub' / 'c.txt').write_text('c')
+        events = get_events(watcher)
+        assert events['tree'] == (flags.MOVED_FROM | flags.ISDIR, False)
+        assert events['moved'][0] & flags.MOVED_TO
+        assert events['moved/sub/c.txt'][1]
+        assert watcher.paths == {str(watched), str(watched / 'moved'), str(watched / 'moved/sub')}
+
+        watcher.remove(watched / 'moved')
+        (watched / 'moved' / 'sub' / 'd.txt').write_text('d')
+        assert not get_events(watcher)
+        assert watcher.paths == {str(watched)}
+
+        # Asynchronous interface
+        async def get_events_async():
+            (watched / 'e.txt').write_text('e')
+            return [e.path async for e in watcher.events_async(timeout=0.2)]
+
+        assert asyncio.run(get_events_async()) == [str(watched / 'e.txt')]
@@ -1,3 +1,4 @@
+import time
 from unittest import mock
 
 import pytest
@@ -21,6 +22,20 @@ def test_to_args_string():
     assert subprocess.to_args_string([10, None, 'string "salut"']) == '10 None \'string "salut"\''
 
 
+def test_kill():
+    process = subprocess.raw_cmd(['sh', '-c', 'sleep 60 & wait'])
+    children, deadline = [], time.monotonic() + 5
+    while hasattr(process, 'children') and not children:
+        assert time.monotonic() < deadline, 'The child process was never spawned'
+        children = process.children(recursive=True)
+        time.sleep(0.01)
+    subprocess.kill(process, recursive=True)
+    assert process.wait() != 0
+    for child in children:
+        child.wait(timeout=5)  # Raise if the child is still running
+    subprocess.kill(process, recursive=True)  # Already terminated
+
+
 def test_cmd():
     log = mock.Mock()
     subprocess.cmd(['echo', 'it seem to work'], log=log)